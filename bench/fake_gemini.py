@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# bench/fake_gemini.py
+"""
+Stand-in for the `gemini` CLI, used by the benchmark. Reads the prompt from stdin
+and answers after a configurable delay, streaming a few lines like the real CLI.
+
+Behaviour is controlled by environment variables:
+  FAKE_GEMINI_LATENCY      Mean seconds before the answer is complete (default 1.0)
+  FAKE_GEMINI_JITTER       +/- seconds of uniform noise on the latency (default 0.2)
+  FAKE_GEMINI_FAIL_RATE    Probability of exiting non-zero with a quota error on stderr (default 0)
+  FAKE_GEMINI_EMPTY_RATE   Probability of exiting 0 with no output (default 0)
+  FAKE_GEMINI_FAIL_MODELS  Comma-separated models that always fail, to exercise fallback
+  FAKE_GEMINI_LINES        Lines in each answer (default 8)
+"""
+import os
+import sys
+import time
+import random
+
+
+def main():
+    model = sys.argv[sys.argv.index("--model") + 1] if "--model" in sys.argv else "unknown"
+    prompt = sys.stdin.read()
+
+    latency = float(os.getenv("FAKE_GEMINI_LATENCY", "1.0"))
+    jitter = float(os.getenv("FAKE_GEMINI_JITTER", "0.2"))
+    lines = max(int(os.getenv("FAKE_GEMINI_LINES", "8")), 1)
+    fail_models = {m.strip() for m in os.getenv("FAKE_GEMINI_FAIL_MODELS", "").split(",") if m.strip()}
+    delay = max(latency + random.uniform(-jitter, jitter), 0.0)
+
+    print("[INFO] Loaded cached credentials.", flush=True)
+    if model in fail_models or random.random() < float(os.getenv("FAKE_GEMINI_FAIL_RATE", "0")):
+        time.sleep(delay / 2)
+        print(f"Error: quota exhausted for {model} (429)", file=sys.stderr, flush=True)
+        sys.exit(1)
+    if random.random() < float(os.getenv("FAKE_GEMINI_EMPTY_RATE", "0")):
+        time.sleep(delay)
+        sys.exit(0)
+
+    print(f"**Analysis** ({model}, {len(prompt)} prompt chars)", flush=True)
+    for i in range(1, lines):
+        time.sleep(delay / lines)
+        print(f"- Point {i}: the market is doing market things.", flush=True)
+    time.sleep(delay / lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# bench/fixtures.py
+"""RSS feed fixtures, a local feed server and simulated Telegram updates for the benchmark."""
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import formatdate
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+FEED_NAMES = {"RSS_COINDESK": "coindesk.xml", "RSS_COINTELEGRAPH": "cointelegraph.xml", "RSS_DECRYPT": "decrypt.xml"}
+
+HEADLINE_TEMPLATES = [
+    "{name} rallies as traders pile into {symbol}",
+    "{name} slips after whale moves {symbol} to exchanges",
+    "Analysts split on where {name} goes next",
+    "${symbol} open interest hits a monthly high",
+    "{name} developers ship long-awaited upgrade",
+    "ETF flows and {name}: what the data says",
+]
+GENERAL_HEADLINES = [
+    "Crypto market steadies ahead of rate decision",
+    "Stablecoin supply climbs for a third straight week",
+    "Regulators outline new rules for exchanges",
+]
+
+SINGLE_QUERIES = ["{symbol}", "what's the latest on {name}?", "price of ${symbol}", "full analysis of {name} please"]
+COMPARE_QUERIES = ["{a} vs {b}", "compare {a} and {b}"]
+BATCH_QUERIES = ["{symbols}", "compare {symbols}"]
+GENERAL_QUERIES = ["what is trending?", "what are the top gainers today?", "how is the market looking?"]
+
+
+def write_rss_fixtures(directory: str, coins: list[dict], items_per_feed: int = 150, seed: int = 1) -> dict:
+    """Writes one RSS file per configured feed and returns {env var: file name}."""
+    rng = random.Random(seed)
+    now = time.time()
+    for feed_index, file_name in enumerate(FEED_NAMES.values()):
+        items = []
+        for i in range(items_per_feed):
+            if i % 10 == 0:
+                title = rng.choice(GENERAL_HEADLINES)
+            else:
+                coin = rng.choice(coins)
+                title = rng.choice(HEADLINE_TEMPLATES).format(name=coin.get("name", coin["symbol"]), symbol=coin["symbol"].upper())
+            published = formatdate(now - (i * 600 + feed_index * 60), usegmt=True)
+            items.append(
+                f"<item><title>{escape(title)}</title><link>https://example.com/{feed_index}/{i}</link>"
+                f"<guid>bench-{feed_index}-{i}</guid><pubDate>{published}</pubDate></item>"
+            )
+        with open(os.path.join(directory, file_name), "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Bench</title>'
+                    + "".join(items) + "</channel></rss>")
+    return dict(FEED_NAMES)
+
+
+class FeedServer:
+    """Serves a directory over HTTP on localhost, with Last-Modified/304 support like a real feed."""
+
+    def __init__(self, directory: str):
+        handler = partial(_QuietHandler, directory=directory)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(name="bench_feed_server", target=self.server.serve_forever, daemon=True)
+
+    def url(self, file_name: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/{file_name}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def generate_queries(coins: list[dict], count: int, mix=(0.55, 0.2, 0.1, 0.15), seed: int = 1) -> list[str]:
+    """`count` user queries, split between single-token, two-token, batch and general questions by `mix`."""
+    rng = random.Random(seed)
+    # Popular coins get asked about much more often, like in real traffic.
+    weights = [1.0 / (rank + 1) for rank in range(len(coins))]
+    queries = []
+    for _ in range(count):
+        kind = rng.choices(["single", "compare", "batch", "general"], weights=mix)[0]
+        if kind == "single":
+            coin = rng.choices(coins, weights=weights)[0]
+            queries.append(rng.choice(SINGLE_QUERIES).format(symbol=coin["symbol"], name=coin.get("name", coin["symbol"])))
+        elif kind == "compare":
+            a, b = rng.sample(coins[:20], 2)
+            queries.append(rng.choice(COMPARE_QUERIES).format(a=a["symbol"], b=b["symbol"]))
+        elif kind == "batch":
+            picked = rng.sample(coins[:20], rng.randint(3, 5))
+            queries.append(rng.choice(BATCH_QUERIES).format(symbols=" ".join(c["symbol"] for c in picked)))
+        else:
+            queries.append(rng.choice(GENERAL_QUERIES))
+    return queries
+
+
+# --- Simulated Telegram objects ---
+# Just enough of telegram.Update / Message / Chat for handle_analysis_query, with a fixed API latency.
+class FakeChat:
+    def __init__(self, chat_id: int, api_latency: float):
+        self.id = chat_id
+        self.api_latency = api_latency
+
+    async def send_action(self, action=None):
+        await asyncio.sleep(self.api_latency)
+
+
+class FakeMessage:
+    def __init__(self, chat: FakeChat, text: str = ""):
+        self.chat = chat
+        self.chat_id = chat.id
+        self.text = text
+
+    async def reply_text(self, text, parse_mode=None, **kwargs):
+        await asyncio.sleep(self.chat.api_latency)
+        return FakeMessage(self.chat, text)
+
+    async def edit_text(self, text, parse_mode=None, **kwargs):
+        await asyncio.sleep(self.chat.api_latency)
+        self.text = text
+        return self
+
+    async def delete(self):
+        await asyncio.sleep(self.chat.api_latency)
+        return True
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, text: str, api_latency: float = 0.05):
+        self.effective_chat = FakeChat(chat_id, api_latency)
+        self.message = FakeMessage(self.effective_chat, text)
@@ -0,0 +1,284 @@
+# bench/run_bench.py
+"""
+Load test for the bot's hot path (`telegram_bot.handle_analysis_query`).
+
+Runs the real pipeline (token extraction, chat memory, the headline store, the LLM
+scheduler, prompt building, the Gemini driver and the outbound Telegram limiter)
+against a fake `gemini` CLI, locally served RSS fixtures and simulated Telegram
+updates. N virtual users each send M messages back to back; the report shows
+end-to-end and per-stage latency percentiles and throughput.
+
+    python bench/run_bench.py --users 20 --messages 10 --gemini-latency 1.5
+"""
+import os
+import io
+import sys
+import json
+import time
+import stat
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import contextvars
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fixtures import FeedServer, FakeUpdate, generate_queries, write_rss_fixtures  # noqa: E402
+
+STAGES = ["extract", "memory", "news", "llm", "send"]
+
+_current = contextvars.ContextVar("bench_request", default=None)
+_by_chat = {}   # chat_id -> RequestTimings of the request that chat has in flight
+
+
+class RequestTimings:
+    def __init__(self, query: str):
+        self.query = query
+        self.stages = defaultdict(float)
+        self.total = 0.0
+        self.response = ""
+
+    @property
+    def outcome(self) -> str:
+        if self.response.startswith("🐢"):
+            return "busy"
+        if "❌" in self.response or self.response.startswith("😵"):
+            return "error"
+        return "ok"
+
+
+def _percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+# --- Stage timers, installed over the names handle_analysis_query looks up ---
+def _add(timings, stage: str, started: float):
+    if timings is not None:
+        timings.stages[stage] += time.perf_counter() - started
+
+
+def _timed(stage: str, func):
+    def wrapper(*args, **kwargs):
+        timings, started = _current.get(), time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add(timings, stage, started)
+    return wrapper
+
+
+def _timed_async(stage: str, func):
+    async def wrapper(*args, **kwargs):
+        timings, started = _current.get(), time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _add(timings, stage, started)
+    return wrapper
+
+
+def install_stage_timers(telegram_bot):
+    save_memory = telegram_bot.save_memory
+    get_analysis = telegram_bot.get_gemini_analysis_async
+
+    def timed_save_memory(chat_id, role, text):
+        timings = _current.get()
+        if timings is not None and role == "assistant":
+            timings.response = str(text)
+        return _timed("memory", save_memory)(chat_id, role, text)
+
+    async def timed_analysis(tokens, news_md, user_query, chat_id, memory, **kwargs):
+        # Runs on a scheduler worker, outside the request's context, so look it up by chat.
+        timings, started = _by_chat.get(chat_id), time.perf_counter()
+        try:
+            return await get_analysis(tokens, news_md, user_query, chat_id, memory, **kwargs)
+        finally:
+            _add(timings, "llm", started)
+
+    class TimedStreamingReply(telegram_bot.StreamingReply):
+        finish = _timed_async("send", telegram_bot.StreamingReply.finish)
+
+    telegram_bot.extract_token_name_symbol = _timed("extract", telegram_bot.extract_token_name_symbol)
+    telegram_bot.load_memory = _timed("memory", telegram_bot.load_memory)
+    telegram_bot.save_memory = timed_save_memory
+    telegram_bot.ensure_headlines_loaded = _timed_async("news", telegram_bot.ensure_headlines_loaded)
+    telegram_bot.fetch_headlines_async = _timed_async("news", telegram_bot.fetch_headlines_async)
+    telegram_bot.get_gemini_analysis_async = timed_analysis
+    telegram_bot.send_chunks = _timed_async("send", telegram_bot.send_chunks)
+    telegram_bot.StreamingReply = TimedStreamingReply
+
+
+# --- Environment ---
+def prepare_environment(workdir: str, args) -> FeedServer:
+    """Fixtures, fake CLI and env vars. Must run before any bot module is imported."""
+    from coin_list import COINS
+
+    feeds_dir = os.path.join(workdir, "feeds")
+    os.makedirs(feeds_dir)
+    feed_files = write_rss_fixtures(feeds_dir, COINS, items_per_feed=args.feed_items, seed=args.seed)
+    server = None
+    if args.rss_files:
+        for env_var, file_name in feed_files.items():
+            os.environ[env_var] = os.path.join(feeds_dir, file_name)
+    else:
+        server = FeedServer(feeds_dir).start()
+        for env_var, file_name in feed_files.items():
+            os.environ[env_var] = server.url(file_name)
+
+    # The driver runs `gemini` from PATH, so put a shim for the fake CLI first.
+    bin_dir = os.path.join(workdir, "bin")
+    os.makedirs(bin_dir)
+    shim = os.path.join(bin_dir, "gemini")
+    with open(shim, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_gemini.py")}" "$@"\n')
+    os.chmod(shim, os.stat(shim).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+    os.environ.update({
+        "FAKE_GEMINI_LATENCY": str(args.gemini_latency),
+        "FAKE_GEMINI_JITTER": str(args.gemini_jitter),
+        "FAKE_GEMINI_FAIL_RATE": str(args.fail_rate),
+        "FAKE_GEMINI_EMPTY_RATE": str(args.empty_rate),
+        "FAKE_GEMINI_FAIL_MODELS": args.fail_models,
+        "QUERY_LOG_PATH": os.path.join(workdir, "logs", "query_log.jsonl"),
+    })
+    # Background prefetching would compete with the measured requests.
+    os.environ.setdefault("PREFETCH_ENABLED", "0")
+    if not args.verbose:
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_TTL"] = "0"
+
+    # The bot keeps chat memory relative to the working directory.
+    os.chdir(workdir)
+    return server
+
+
+# --- Load ---
+async def virtual_user(telegram_bot, chat_id: int, queries: list, api_latency: float, results: list):
+    for query in queries:
+        timings = RequestTimings(query)
+        token = _current.set(timings)
+        _by_chat[chat_id] = timings
+        started = time.perf_counter()
+        try:
+            await telegram_bot.handle_analysis_query(query, FakeUpdate(chat_id, query, api_latency))
+        finally:
+            timings.total = time.perf_counter() - started
+            _current.reset(token)
+            _by_chat.pop(chat_id, None)
+            results.append(timings)
+
+
+async def run_load(telegram_bot, args) -> tuple:
+    from coin_list import COINS
+
+    # Load the feeds once up front, so the numbers describe steady state rather than a cold start.
+    await telegram_bot.ensure_headlines_loaded()
+
+    queries = generate_queries(COINS, args.users * args.messages, mix=args.mix, seed=args.seed)
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        virtual_user(telegram_bot, 1000 + i, queries[i * args.messages:(i + 1) * args.messages], args.telegram_latency, results)
+        for i in range(args.users)
+    ))
+    return results, time.perf_counter() - started
+
+
+def summarize(results: list, elapsed: float, args, cache, scheduler) -> dict:
+    def latency(samples):
+        return {name: round(_percentile(samples, pct) * 1000, 1) for name, pct in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))} \
+            | {"max": round(max(samples, default=0.0) * 1000, 1)}
+
+    outcomes = defaultdict(int)
+    for r in results:
+        outcomes[r.outcome] += 1
+    return {
+        "users": args.users,
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "outcomes": dict(outcomes),
+        "latency_ms": {"end_to_end": latency([r.total for r in results])}
+                      | {stage: latency([r.stages[stage] for r in results]) for stage in STAGES},
+        "cache": {"hits": cache.hits, "misses": cache.misses, "coalesced": cache.coalesced},
+        "scheduler": scheduler.stats(),
+    }
+
+
+def print_report(summary: dict):
+    print(f"\n📊 {summary['requests']} requests from {summary['users']} users in {summary['elapsed_s']}s "
+          f"({summary['messages_per_s']} msg/s)")
+    print("   outcomes: " + ", ".join(f"{k} {v}" for k, v in sorted(summary["outcomes"].items())))
+    print(f"\n{'stage (ms)':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, values in summary["latency_ms"].items():
+        print(f"{stage:<12}" + "".join(f"{values[k]:>10}" for k in ("p50", "p95", "p99", "max")))
+    cache = summary["cache"]
+    print(f"\n   cache: {cache['hits']} hits, {cache['coalesced']} coalesced, {cache['misses']} misses")
+    scheduler = summary["scheduler"]
+    print(f"   LLM queue wait: p50 {scheduler['wait_p50_s']}s, p95 {scheduler['wait_p95_s']}s, max {scheduler['wait_max_s']}s "
+          f"({scheduler['rejected']} rejected)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the CoinCub pipeline with a fake Gemini CLI and local feeds.")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users (one chat each)")
+    parser.add_argument("--messages", type=int, default=5, help="Messages each user sends, one after another")
+    parser.add_argument("--mix", type=float, nargs=4, default=(0.55, 0.2, 0.1, 0.15), metavar=("SINGLE", "COMPARE", "BATCH", "GENERAL"),
+                        help="Relative share of single-token, two-token, multi-token and general queries")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="Mean seconds the fake CLI takes to answer")
+    parser.add_argument("--gemini-jitter", type=float, default=0.2)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probability a model call fails")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Probability a model call returns nothing")
+    parser.add_argument("--fail-models", default="", help="Comma-separated models that always fail")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Seconds per simulated Telegram API call")
+    parser.add_argument("--feed-items", type=int, default=150, help="Entries in each RSS fixture")
+    parser.add_argument("--rss-files", action="store_true", help="Read feeds from files instead of a local HTTP server")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the shared analysis cache")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the summary to this file, for comparing runs")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="coincub-bench-")
+    server = prepare_environment(workdir, args)
+    try:
+        import query_log
+        import telegram_bot
+        from llm_scheduler import llm_scheduler
+        from response_cache import analysis_cache
+
+        install_stage_timers(telegram_bot)
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            results, elapsed = asyncio.run(run_load(telegram_bot, args))
+            telegram_bot.memory_store.flush()
+            query_log.query_log.close()
+
+        summary = summarize(results, elapsed, args, analysis_cache, llm_scheduler)
+        print_report(summary)
+        if args.json:
+            with open(os.path.join(cwd, args.json), "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+    finally:
+        if server:
+            server.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# coin_list.py
+import os
+import json
+
+COINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "coins.json")
+
+
+def load_coins(path: str = COINS_PATH) -> list[dict]:
+    """Loads the local coin list (symbol, name, aliases). Returns an empty list if it's missing."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"⚠️ Could not load coin list from {path}: {e}")
+        return []
+
+
+def build_alias_map(coins: list[dict]) -> dict[tuple, str]:
+    """Maps every known spelling of a coin, as a tuple of lowercase words, to its canonical symbol."""
+    alias_map = {}
+    for coin in coins:
+        symbol = coin["symbol"].lower()
+        for spelling in [symbol, coin.get("name", "")] + coin.get("aliases", []):
+            words = tuple(spelling.lower().split())
+            if words:
+                alias_map.setdefault(words, symbol)
+    return alias_map
+
+
+COINS = load_coins()
+ALIAS_MAP = build_alias_map(COINS)
+MAX_ALIAS_WORDS = max((len(k) for k in ALIAS_MAP), default=1)
+
+
+def canonical_symbol(name_or_symbol: str) -> str | None:
+    """Returns the canonical symbol for a known coin name/symbol/alias (e.g. 'Bitcoin' -> 'btc')."""
+    words = tuple(name_or_symbol.lower().lstrip("$").split())
+    return ALIAS_MAP.get(words)
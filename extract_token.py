@@ -1,75 +1,265 @@
 #extract_token.py
 import re
+import logging
+from typing import NamedTuple
 
-def extract_token_name_symbol(user_input: str) -> list[str]:
+from coin_list import COINS
+from metrics import log_event, span
+
+# A comprehensive, expanded list of words to ignore.
+STOP_WORDS = frozenset({
+    # Standard Stop Words (articles, prepositions, pronouns, etc.)
+    'a', 'about', 'after', 'all', 'also', 'am', 'an', 'and', 'any', 'are', 'as', 'at', 'be',
+    'because', 'been', 'but', 'by', 'can', 'could', 'did', 'do', 'does', 'doing', 'for',
+    'from', 'further', 'had', 'has', 'have', 'having', 'he', 'her', 'how', 'i', 'if', 'in',
+    'into', 'is', 'it', 'its', 'just', 'me', 'more', 'my', 'no', 'not', 'now', 'of', 'on',
+    'or', 'our', 'should', 'so', 'some', 'than', 'that', 'the', 'their', 'them', 'then',
+    'there', 'these', 'they', 'this', 'to', 'up', 'us', 'was', 'we', 'were', 'what', 'when',
+    'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your', 'goes', 'going',
+
+    # Contractions once punctuation is stripped
+    'hows', 'whats', 'wheres', 'whens', 'whys',
+
+    # Action & Intent Words
+    'analyze', 'buy', 'check', 'compare', 'explain', 'find', 'get', 'give', 'go',
+    'know', 'list', 'look', 'see', 'sell', 'show', 'tell', 'trade', 'view', 'tells', 'think',
+
+    # Financial & Crypto Terms
+    'cap', 'chart', 'coin', 'coins', 'crypto', 'data', 'details', 'info', 'information',
+    'liquidity', 'market', 'movers', 'overview', 'performance', 'performing', 'price',
+    'prices', 'report', 'stats', 'summary', 'token', 'tokens', 'value', 'volatility', 'volume',
+    'gainers', 'losers', 'news', 'analysis', 'update', 'risk', 'ath', 'pump', 'dump', 'moon',
+    'bullish', 'bearish',
+
+    # Descriptive & Qualitative Words
+    'bad', 'best', 'good', 'high', 'hot', 'latest', 'low', 'new', 'recent', 'safe', 'top',
+    'trending', 'worse', 'worst', 'risky', 'trendiest', 'trendy',
+
+    # Time-related Words
+    'currently', 'today', 'tomorrow', 'tmrw', 'tmr', 'yesterday', 'ytd', 'week', 'month',
+    'past', 'last', 'hour', 'hours', 'day', 'days', 'weeks', 'months',
+
+    # Quantifiers
+    'each', 'every', 'few', 'most',
+
+    # Conversational Fillers
+    'hello', 'help', 'hey', 'ok', 'okay', 'please', 'thanks', 'thank', 'pls', 'plz', 'thx',
+
+    # Other Common Nouns/Verbs
+    'versus', 'vs', 'comparing',
+})
+
+# Coin symbols/names that are also everyday English; only trusted when written as $X, in caps, or alone.
+AMBIGUOUS_WORDS = frozenset({
+    'link', 'near', 'op', 'dot', 'uni', 'ton', 'sand', 'mana', 'render', 'maker', 'stacks',
+    'immutable', 'jupiter', 'cosmos', 'stellar', 'polygon', 'optimism', 'trump', 'sei', 'pol',
+    'ether', 'sats', 'hype', 'bonk', 'sandbox', 'lido', 'tron', 'avalanche',
+})
+
+# Confidence scores per kind of match.
+DOLLAR_KNOWN = 1.0
+DOLLAR_UNKNOWN = 0.9
+KNOWN_COIN = 0.95
+AMBIGUOUS_COIN = 0.4
+UNKNOWN_WORD = 0.3
+SOLE_WORD_FLOOR = 0.6   # A one-word query like "/ask pepe" is almost certainly a token.
+CONTEXT_FLOOR = 0.8     # Named next to "vs"/"compare", or part of a bare list like "btc eth sol link".
+MIN_CONFIDENCE = 0.5
+
+# Words that say "the words around me are tokens". "and" only counts in a query that compares.
+COMPARE_WORDS = frozenset({'compare', 'comparing'})
+VERSUS_WORDS = frozenset({'vs', 'versus'})
+_CONNECTORS = COMPARE_WORDS | VERSUS_WORDS | {'and'}
+
+# Words that only ask for "an analysis of these tokens". A query made of tokens and these words alone
+# is answered by the shared, cached analysis; anything else ("should I sell my eth?") gets its own.
+NAMING_WORDS = _CONNECTORS | frozenset({
+    'a', 'an', 'the', 'of', 'on', 'for', 'about', 'with', 'me', 'us', 'please', 'pls', 'plz',
+    'hey', 'hello', 'hi', 'thanks', 'thx', 'what', 'whats', 'how', 'hows', 'is', 'are', 'give',
+    'show', 'get', 'tell', 'check', 'analyze', 'analysis', 'full', 'quick', 'latest', 'update',
+    'info', 'overview', 'summary', 'report', 'news', 'price', 'prices', 'token', 'tokens', 'coin', 'coins',
+})
+
+_WORD_RE = re.compile(r'\$?[a-zA-Z0-9][a-zA-Z0-9-]*')
+# Time ranges like "today", "this week" or "past 3 days", for news questions. Units must be spelled
+# out; of the short forms only 24h/7d/30d count, so "3d rendering" isn't a three-day window.
+_TIME_RANGE_RE = re.compile(
+    r"\b(?:(?P<count>\d{1,3})\s*(?P<unit>hours?|hrs?|days?|weeks?)"
+    r"|(?P<named>today|yesterday|24h|7d|30d|(?:this|past|last)\s+(?:week|month)))\b",
+    re.IGNORECASE,
+)
+_UNIT_SECONDS = {"h": 3600, "d": 86400, "w": 7 * 86400}
+_NAMED_RANGES = {"today": 86400, "24h": 86400, "yesterday": 2 * 86400, "7d": 7 * 86400, "30d": 30 * 86400,
+                 "week": 7 * 86400, "month": 30 * 86400}
+_PUNCTUATION_RE = re.compile(r"[^\w\s$-]")
+
+
+class TokenMatch(NamedTuple):
+    id: str            # Canonical symbol, e.g. "btc"
+    text: str          # What the user actually wrote, e.g. "Bitcoin"
+    confidence: float
+
+
+def _build_trie(coins: list[dict]) -> dict:
+    """Word-level trie over every coin symbol, name and alias. A "$" key marks a complete match."""
+    trie = {}
+    for coin in coins:
+        symbol = coin["symbol"].lower()
+        for spelling in [symbol, coin.get("name", "")] + coin.get("aliases", []):
+            words = spelling.lower().split()
+            if not words:
+                continue
+            node = trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node.setdefault("$", symbol)
+    return trie
+
+
+_TRIE = _build_trie(COINS)
+
+
+def _longest_match(words: list[str], start: int) -> tuple:
+    """Longest known coin starting at `words[start]`. Returns (symbol, number_of_words) or (None, 0)."""
+    node, best, best_len = _TRIE, None, 0
+    for i in range(start, len(words)):
+        node = node.get(words[i])
+        if node is None:
+            break
+        if "$" in node:
+            best, best_len = node["$"], i - start + 1
+    return best, best_len
+
+
+def _trusted_by_context(slots: list) -> set:
+    """
+    Indexes of the matches named right next to a comparison word ("near vs sol",
+    "compare pnut and goat"). `slots` is the query with stop words dropped: match
+    indexes, with connector words kept as strings.
+    """
+    comparing = any(slot in COMPARE_WORDS for slot in slots)
+    trusted = set()
+    for pos, slot in enumerate(slots):
+        if slot in VERSUS_WORDS or (slot == "and" and comparing):
+            neighbours = (pos - 1, pos + 1)
+        elif slot in COMPARE_WORDS:
+            neighbours = (pos + 1,)
+        else:
+            continue
+        trusted.update(slots[n] for n in neighbours if 0 <= n < len(slots) and isinstance(slots[n], int))
+    return trusted
+
+
+def extract_tokens(user_input: str) -> list[TokenMatch]:
     """
-    Extracts one or more token names or symbols from user input using a comprehensive
-    stop word list and robust text normalization.
+    Extracts token mentions in a single pass over the input, resolving known coins
+    (longest multi-word match first, e.g. "bitcoin cash" before "bitcoin") to their
+    canonical symbol. Every match carries a confidence score; ambiguous and unknown
+    words are trusted when the query's shape says they're tokens (see CONTEXT_FLOOR).
     """
     if not user_input:
         return []
 
-    # A comprehensive, expanded list of words to ignore.
-    stop_words = {
-        # Standard Stop Words (articles, prepositions, pronouns, etc.)
-        'a', 'about', 'after', 'all', 'also', 'am', 'an', 'and', 'any', 'are', 'as', 'at', 'be',
-        'because', 'been', 'but', 'by', 'can', 'could', 'did', 'do', 'does', 'doing', 'for', 
-        'from', 'further', 'had', 'has', 'have', 'having', 'he', 'her', 'how', 'i', 'if', 'in', 
-        'into', 'is', 'it', 'its', 'just', 'me', 'more', 'my', 'no', 'not', 'now', 'of', 'on', 
-        'or', 'our', 'should', 'so', 'some', 'than', 'that', 'the', 'their', 'them', 'then', 
-        'there', 'these', 'they', 'this', 'to', 'up', 'us', 'was', 'we', 'were', 'what', 'when', 
-        'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your','goes', 'going',
-
-        # Action & Intent Words
-        'analyze', 'buy', 'check', 'compare', 'explain', 'find', 'get', 'give', 'go', 'going',
-        'know', 'list', 'look', 'see', 'sell', 'show', 'tell', 'trade', 'view', 'tell', 'tells', 
-
-        # Financial & Crypto Terms
-        'cap', 'chart', 'coin', 'coins', 'crypto', 'data', 'details', 'info', 'information',
-        'liquidity', 'market', 'movers', 'overview', 'performance', 'performing', 'price', 
-        'prices', 'report', 'stats', 'summary', 'token', 'tokens', 'value', 'volatility', 'volume', 'tokens', 'token',
-
-        # Descriptive & Qualitative Words
-        'bad', 'best', 'good', 'high', 'hot', 'latest', 'low', 'new', 'recent', 'safe', 'top', 
-        'trending', 'worse', 'worst', 'risky', 'trendiest', 'trendy'
-
-        # Time-related Words
-        'currently', 'today', 'tomorrow', 'tmrw', 'tmr','yesterday','ytd','now',        
-
-        #Quantifiers
-        'all', 'any', 'each', 'every', 'few', 'most', 'some',
-
-        # Conversational Fillers
-        'hello', 'help', 'hey', 'ok', 'okay', 'please', 'thanks', 'thank', 'pls' ,'plz', 'thx',
-
-        # Other Common Nouns/Verbs
-        'versus', 'vs' ,'compare', 'comparing',
-    }
-
-    # Normalize input: lowercase
-    normalized_input = user_input.lower()
-
-    # Find and handle $SYMBOLS first, and remove them from the string to avoid double-counting
-    dollar_symbols = re.findall(r'\$([a-zA-Z0-9]{2,10})', normalized_input)
-    normalized_input = re.sub(r'\$[a-zA-Z0-9]{2,10}', '', normalized_input)
-
-    # Aggressively remove all punctuation, including apostrophes from contractions.
-    normalized_input = re.sub(r'[^\w\s-]', '', normalized_input)
-
-    # Add contraction variations to the stop word list
-    stop_words.update(['hows', 'whats', 'wheres', 'whens', 'whys', 'its'])
-
-    # Find all remaining word-based tokens and filter them
-    potential_tokens = re.findall(r'\b[a-zA-Z0-9-]{2,20}\b', normalized_input)
-    word_tokens = [token for token in potential_tokens if token not in stop_words and not token.isdigit()]
-
-    # Combine, ensure uniqueness, and maintain order
-    all_tokens = []
-    seen = set()
-    for token in dollar_symbols + word_tokens:
-        if token not in seen:
-            seen.add(token)
-            all_tokens.append(token)
-
-    print(f"Extracted tokens: {all_tokens} from query: '{user_input}'")
-    return all_tokens
\ No newline at end of file
+    raw_words = _WORD_RE.findall(_PUNCTUATION_RE.sub(" ", user_input))
+    words = [w.lower().lstrip("$") for w in raw_words]
+    candidate_count = sum(1 for w in words if w not in STOP_WORDS and not w.isdigit())
+
+    matches = []
+    slots = []      # match indexes and connector words, in query order
+    filler = 0      # stop words other than connectors
+    i = 0
+    while i < len(words):
+        raw, word = raw_words[i], words[i]
+
+        if raw.startswith("$"):
+            symbol, _ = _longest_match(words, i)
+            if 2 <= len(word) <= 10:
+                slots.append(len(matches))
+                matches.append(TokenMatch(symbol or word, raw, DOLLAR_KNOWN if symbol else DOLLAR_UNKNOWN))
+            i += 1
+            continue
+
+        symbol, length = _longest_match(words, i)
+        if symbol:
+            text = " ".join(raw_words[i:i + length])
+            confidence = KNOWN_COIN
+            if length == 1 and word in AMBIGUOUS_WORDS and not raw.isupper():
+                confidence = AMBIGUOUS_COIN
+            slots.append(len(matches))
+            matches.append(TokenMatch(symbol, text, confidence))
+            i += length
+            continue
+
+        if word in _CONNECTORS:
+            slots.append(word)
+        elif word in STOP_WORDS:
+            filler += 1
+        elif not word.isdigit() and 2 <= len(word) <= 20:
+            slots.append(len(matches))
+            matches.append(TokenMatch(word, raw, UNKNOWN_WORD))
+        i += 1
+
+    if candidate_count == 1:
+        matches = [m._replace(confidence=max(m.confidence, SOLE_WORD_FLOOR)) for m in matches]
+
+    # A bare list of tokens: every candidate is a known coin or a $SYMBOL ("btc eth sol link"), or
+    # at least two known coins joined by a connector with nothing else around ("btc, eth and pnut").
+    # One coin next to an unknown word ("bitcoin halving", "eth staking") is not a list.
+    known = sum(1 for m in matches if m.confidence > UNKNOWN_WORD)
+    connected = any(isinstance(slot, str) for slot in slots)
+    if matches and (known == len(matches) or (not filler and connected and known >= 2)):
+        trusted = set(range(len(matches)))
+    else:
+        trusted = _trusted_by_context(slots)
+    matches = [m._replace(confidence=max(m.confidence, CONTEXT_FLOOR)) if n in trusted else m for n, m in enumerate(matches)]
+
+    # Ensure uniqueness by canonical id, keep the best score and the order of first mention.
+    best = {}
+    for match in matches:
+        if match.id not in best or match.confidence > best[match.id].confidence:
+            best[match.id] = match if match.id not in best else best[match.id]._replace(confidence=match.confidence)
+    return list(best.values())
+
+
+def names_only(user_input: str, tokens: list[str]) -> bool:
+    """
+    True when the query does nothing but name or compare `tokens` ("btc", "eth vs sol",
+    "full analysis of $PEPE please"), i.e. the shared token analysis answers it as asked.
+    """
+    if not tokens:
+        return False
+    wanted = set(tokens)
+    raw_words = _WORD_RE.findall(_PUNCTUATION_RE.sub(" ", user_input or ""))
+    words = [w.lower().lstrip("$") for w in raw_words]
+    i = 0
+    while i < len(words):
+        symbol, length = _longest_match(words, i)
+        if symbol in wanted:
+            i += length
+        elif words[i] in wanted or words[i] in NAMING_WORDS:
+            i += 1
+        else:
+            return False
+    return True
+
+
+def extract_time_window(user_input: str):
+    """How far back a question asks about, in seconds ("news this week on sol" -> 7 days), or None."""
+    match = _TIME_RANGE_RE.search(user_input or "")
+    if not match:
+        return None
+    if match.group("count"):
+        return int(match.group("count")) * _UNIT_SECONDS[match.group("unit")[0].lower()]
+    return _NAMED_RANGES[match.group("named").lower().split()[-1]]
+
+
+def extract_token_name_symbol(user_input: str, min_confidence: float = MIN_CONFIDENCE) -> list[str]:
+    """
+    Extracts one or more tokens from user input and returns their canonical ids,
+    keeping only matches at or above `min_confidence`.
+    """
+    with span("extract"):
+        all_tokens = [m.id for m in extract_tokens(user_input) if m.confidence >= min_confidence]
+
+    log_event("tokens_extracted", logging.DEBUG, tokens=all_tokens)
+    return all_tokens
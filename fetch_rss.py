@@ -1,9 +1,18 @@
 # fetch_rss.py
 import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+import aiohttp
 import feedparser
-import re
 from dotenv import load_dotenv
 
+from metrics import ERRORS, log_event, span
+from news_snapshot import NewsSnapshot
+from news_store import HeadlineStore, article_from_entry
+
 load_dotenv()
 
 RSS_FEEDS = {
@@ -12,47 +21,314 @@ RSS_FEEDS = {
     "Decrypt": os.getenv("RSS_DECRYPT")
 }
 
+# How often the background poller refreshes each feed, and how many entries we keep in memory.
+RSS_REFRESH_SECONDS = int(os.getenv("RSS_REFRESH_SECONDS", "300"))
+RSS_MAX_ENTRIES = int(os.getenv("RSS_MAX_ENTRIES", "1000"))
+RSS_FETCH_TIMEOUT = float(os.getenv("RSS_FETCH_TIMEOUT", "8"))
+# On-disk copy of recent headlines for fast restarts and time-ranged questions. Empty disables it.
+NEWS_SNAPSHOT_PATH = os.getenv("NEWS_SNAPSHOT_PATH", "cache/news_snapshot.sqlite3")
+NEWS_HISTORY_DAYS = float(os.getenv("NEWS_HISTORY_DAYS", "30"))
+
+headline_store = HeadlineStore(max_entries=RSS_MAX_ENTRIES)
+news_snapshot = NewsSnapshot(NEWS_SNAPSHOT_PATH, NEWS_HISTORY_DAYS * 86400) if NEWS_SNAPSHOT_PATH else None
+
+# ETag / Last-Modified validators per feed, so unchanged feeds come back as a cheap 304.
+_feed_validators = {}
+_refresh_lock = threading.Lock()
+_poller_thread = None
+_initial_load = None
+_snapshot_restored = False
+_restore_lock = threading.Lock()
+
+
+def refresh_feed(source_name: str, feed_url: str) -> int:
+    """
+    Reads a single feed through feedparser and stores any new entries. feedparser has no
+    socket timeout, so HTTP feeds go through `refresh_feeds_async` instead.
+    """
+    validators = _feed_validators.get(source_name, {})
+    with span("feed_fetch", source_name):
+        feed = feedparser.parse(feed_url, etag=validators.get("etag"), modified=validators.get("modified"))
+
+    if feed.get("status") == 304:
+        return 0
+    return _store_feed(source_name, feed, feed.get("etag"), feed.get("modified"))
+
+
+def _store_feed(source_name: str, feed, etag: str = None, modified: str = None) -> int:
+    """Stores the new entries of a parsed feed and remembers its validators."""
+    if feed.get("bozo") and not feed.entries:
+        # feedparser doesn't raise on network or parse errors; it just returns nothing.
+        raise feed.get("bozo_exception") or ValueError("the feed returned no entries")
+
+    validators = {"etag": etag, "modified": modified}
+    _feed_validators[source_name] = validators
+    added = headline_store.add_articles([article_from_entry(source_name, entry) for entry in feed.entries])
+    if news_snapshot:
+        try:
+            news_snapshot.save(source_name, added, **validators)
+        except sqlite3.Error as e:
+            ERRORS.inc(stage="news_snapshot")
+            log_event("news_snapshot_save_failed", logging.WARNING, source=source_name, error=str(e))
+    return len(added)
+
+
+def restore_snapshot() -> int:
+    """
+    Loads the last saved headlines and feed validators into memory, once per process,
+    so a restarted bot serves news before its first network refresh finishes.
+    """
+    global _snapshot_restored
+    with _restore_lock:
+        if _snapshot_restored or not news_snapshot:
+            return 0
+        _snapshot_restored = True
+        try:
+            articles = news_snapshot.recent(RSS_MAX_ENTRIES)
+            validators = news_snapshot.validators()
+            last_refresh = news_snapshot.last_refresh()
+        except sqlite3.Error as e:
+            ERRORS.inc(stage="news_snapshot")
+            log_event("news_snapshot_load_failed", logging.WARNING, path=NEWS_SNAPSHOT_PATH, error=str(e))
+            return 0
+
+    # Oldest first, so the store's insertion-order eviction still drops the oldest.
+    restored = len(headline_store.add_articles(articles[::-1]))
+    for source_name, feed_validators in validators.items():
+        _feed_validators.setdefault(source_name, feed_validators)
+    if restored and not headline_store.last_refresh:
+        headline_store.last_refresh = last_refresh
+    log_event("news_snapshot_restored", articles=restored, age_s=round(time.time() - last_refresh) if last_refresh else None)
+    return restored
+
+
+def _prune_snapshot():
+    if news_snapshot:
+        try:
+            news_snapshot.prune()
+        except sqlite3.Error as e:
+            log_event("news_snapshot_prune_failed", logging.WARNING, error=str(e))
+
+
+def refresh_feeds() -> int:
+    """
+    Refreshes every configured feed once, blocking until done. Returns the number of new
+    entries stored. Uses the same timed downloads as `refresh_feeds_async`, so a hung feed
+    can't stall the poller; don't call it from a thread that's running an event loop.
+    """
+    with _refresh_lock:
+        return asyncio.run(refresh_feeds_async())
+
+
+def _poll_forever(interval: int):
+    while True:
+        refresh_feeds()
+        time.sleep(interval)
+
+
+def start_rss_poller(interval: int = RSS_REFRESH_SECONDS):
+    """Starts the background poller thread (once). Safe to call more than once."""
+    global _poller_thread
+    if _poller_thread and _poller_thread.is_alive():
+        return _poller_thread
+    restore_snapshot()
+    _poller_thread = threading.Thread(name="rss_poller", target=_poll_forever, args=(interval,), daemon=True)
+    _poller_thread.start()
+    return _poller_thread
+
+
+def sync_from_snapshot() -> int:
+    """Adds headlines another process has saved to the snapshot since we last looked. Returns how many."""
+    try:
+        articles = news_snapshot.recent(RSS_MAX_ENTRIES)
+        last_refresh = news_snapshot.last_refresh()
+    except sqlite3.Error as e:
+        ERRORS.inc(stage="news_snapshot")
+        log_event("news_snapshot_load_failed", logging.WARNING, path=NEWS_SNAPSHOT_PATH, error=str(e))
+        return 0
+    added = len(headline_store.add_articles(articles[::-1]))
+    headline_store.last_refresh = max(headline_store.last_refresh, last_refresh)
+    return added
+
+
+def _follow_snapshot_forever(interval: int):
+    while True:
+        time.sleep(interval)
+        sync_from_snapshot()
+
+
+def start_snapshot_follower(interval: int = RSS_REFRESH_SECONDS):
+    """
+    For processes that leave polling to another one (webhook workers other than the first):
+    keeps the in-memory store in step with the shared snapshot instead of fetching the feeds again.
+    """
+    global _poller_thread
+    if _poller_thread and _poller_thread.is_alive():
+        return _poller_thread
+    restore_snapshot()
+    _poller_thread = threading.Thread(name="snapshot_follower", target=_follow_snapshot_forever, args=(interval,), daemon=True)
+    _poller_thread.start()
+    return _poller_thread
+
+
+def _ensure_loaded():
+    # Without a running poller (e.g. the CLI example below) do one blocking refresh on first use.
+    restore_snapshot()
+    if not headline_store.last_refresh:
+        refresh_feeds()
+
+
+def _public_fields(stored: dict) -> dict:
+    return {
+        "source": stored["source"],
+        "title": stored["title"],
+        "published": stored["published"],
+        "link": stored["link"]
+    }
+
+
 # --- UPGRADED FUNCTION ---
 def fetch_token_headlines(token_name_or_symbol: str = None, max_articles: int = 2):
     """
-    Fetches headlines. If a token is provided, it filters for that token.
-    If no token is provided, it fetches the latest general headlines.
-    """
-    found_articles = []
-
-    for source_name, feed_url in RSS_FEEDS.items():
-        if not feed_url:
-            continue
-
-        feed = feedparser.parse(feed_url)
-        for entry in feed.entries:
-            article = {
-                "source": source_name,
-                "title": entry.get("title", "").strip(),
-                "published": entry.get("published", "").strip(),
-                "link": entry.get("link", "").strip()
-            }
-            
-            # If no token is specified, just add the latest articles and move on.
-            if not token_name_or_symbol:
-                found_articles.append(article)
-                continue
-
-            # If a token IS specified, filter by it.
-            token = token_name_or_symbol.lower()
-            summary = entry.get("summary", "")
-            combined_text = f"{article['title']} {summary}".lower()
-
-            if re.search(rf"\b\${token}\b", combined_text) or token in combined_text:
-                found_articles.append(article)
-
-    # Sort by published date if available, otherwise keep order. A bit of safety.
+    Returns headlines from the in-memory store. If a token is provided, it looks it up
+    in the inverted index (symbols, `$SYMBOL` mentions and known coin names all match).
+    If no token is provided, it returns the latest general headlines.
+    """
+    _ensure_loaded()
+    tokens = [token_name_or_symbol] if token_name_or_symbol else []
+    return [_public_fields(a) for a in headline_store.search(tokens, limit=max_articles)]
+
+
+def headlines_to_markdown(headlines: list[dict], empty_message: str = "No relevant news found.") -> str:
+    """The bullet list of headlines that goes into the prompt."""
+    return "\n".join([f"- “{n['title']}” — {n['source']}, {n['published']}" for n in headlines]) or empty_message
+
+
+def headlines_to_markdown_by_token(headlines_by_token: dict, empty_message: str = "No relevant news found.") -> str:
+    """
+    Headlines for several tokens as one list, each line tagged with its token. Lines are
+    interleaved round-robin (every token's newest headline first), so when the prompt
+    budget trims the list from the end each token keeps a fair share of the news.
+    """
+    seen, lines = set(), []
+    columns = [[(token, h) for h in headlines] for token, headlines in headlines_by_token.items()]
+    for row in range(max((len(c) for c in columns), default=0)):
+        for column in columns:
+            if row < len(column):
+                token, n = column[row]
+                identity = n["link"] or n["title"]
+                if identity not in seen:
+                    seen.add(identity)
+                    lines.append(f"- [{token.upper()}] “{n['title']}” — {n['source']}, {n['published']}")
+    return "\n".join(lines) or empty_message
+
+
+# --- Async API (used by the bot so feeds never block the event loop) ---
+def _parse_and_store(source_name: str, body: bytes, headers: dict) -> int:
+    feed = feedparser.parse(body, response_headers=headers)
+    return _store_feed(source_name, feed, headers.get("ETag"), headers.get("Last-Modified"))
+
+
+async def _download_feed(session: aiohttp.ClientSession, source_name: str, feed_url: str):
+    """Conditional GET of one feed. Returns `(body, headers)`, or None if it hasn't changed."""
+    validators = _feed_validators.get(source_name, {})
+    request_headers = {"User-Agent": feedparser.USER_AGENT}
+    if validators.get("etag"):
+        request_headers["If-None-Match"] = validators["etag"]
+    if validators.get("modified"):
+        request_headers["If-Modified-Since"] = validators["modified"]
+    with span("feed_fetch", source_name):
+        async with session.get(feed_url, headers=request_headers) as response:
+            if response.status == 304:
+                return None
+            response.raise_for_status()
+            return await response.read(), dict(response.headers)
+
+
+async def _refresh_feed_async(session: aiohttp.ClientSession, source_name: str, feed_url: str, timeout: float) -> int:
     try:
-        found_articles.sort(key=lambda x: feedparser._parse_date(x['published']), reverse=True)
-    except Exception:
-        pass # If parsing fails, just use the feed order.
+        if not feed_url.startswith(("http://", "https://")):
+            # Local files (e.g. the benchmark's fixtures) can't hang, so feedparser can read them directly.
+            return await asyncio.to_thread(refresh_feed, source_name, feed_url)
+        # aiohttp enforces the timeout on the socket itself, so a hung feed doesn't pin an executor thread.
+        downloaded = await _download_feed(session, source_name, feed_url)
+        if downloaded is None:
+            return 0
+        return await asyncio.to_thread(_parse_and_store, source_name, *downloaded)
+    except asyncio.TimeoutError:
+        ERRORS.inc(stage="feed_fetch")
+        log_event("feed_refresh_timeout", logging.WARNING, source=source_name, timeout_s=timeout)
+    except Exception as e:
+        ERRORS.inc(stage="feed_fetch")
+        log_event("feed_refresh_failed", logging.WARNING, source=source_name, error=str(e))
+    return 0
+
+
+async def refresh_feeds_async(timeout: float = RSS_FETCH_TIMEOUT) -> int:
+    """Refreshes every configured feed concurrently, giving each one at most `timeout` seconds."""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        results = await asyncio.gather(*[
+            _refresh_feed_async(session, source_name, feed_url, timeout)
+            for source_name, feed_url in RSS_FEEDS.items() if feed_url
+        ])
+    headline_store.last_refresh = time.time()
+    await asyncio.to_thread(_prune_snapshot)
+    return sum(results)
+
+
+async def ensure_headlines_loaded():
+    """
+    Returns immediately once the store has been filled (normally by the poller or
+    from the on-disk snapshot). On a cold start, concurrent callers share a single
+    concurrent refresh.
+    """
+    global _initial_load
+    if not _snapshot_restored:
+        await asyncio.to_thread(restore_snapshot)
+    if headline_store.last_refresh:
+        stale = time.time() - headline_store.last_refresh > RSS_REFRESH_SECONDS
+        poller_running = _poller_thread is not None and _poller_thread.is_alive()
+        if stale and not poller_running and (_initial_load is None or _initial_load.done()):
+            # Serving an old snapshot; refresh in the background rather than making this caller wait.
+            _initial_load = asyncio.ensure_future(refresh_feeds_async())
+        return
+    if _initial_load is None or _initial_load.done():
+        _initial_load = asyncio.ensure_future(refresh_feeds_async())
+    await asyncio.shield(_initial_load)
+
+
+def headlines_since(tokens: list[str], since: float, max_articles: int = 2) -> dict:
+    """
+    Like `fetch_headlines_async`, but only headlines published after `since` (epoch seconds),
+    looked up in the snapshot's history so they can be older than what's kept in memory.
+    """
+    keys = tokens or [None]
+    if news_snapshot:
+        try:
+            return {key: [_public_fields(a) for a in news_snapshot.search([key] if key else [], since, max_articles)] for key in keys}
+        except sqlite3.Error as e:
+            ERRORS.inc(stage="news_snapshot")
+            log_event("news_snapshot_search_failed", logging.WARNING, error=str(e))
+    return {
+        key: [_public_fields(a) for a in headline_store.search([key] if key else []) if a["published_ts"] >= since][:max_articles]
+        for key in keys
+    }
+
+
+async def fetch_headlines_async(tokens: list[str], max_articles: int = 2, since: float = None) -> dict:
+    """
+    Headlines for several tokens in one fan-out, as `{token: [headline, ...]}`.
+    An empty token list returns the latest general headlines under the key `None`.
+    With `since` (epoch seconds), only headlines published after it are returned.
+    """
+    await ensure_headlines_loaded()
+    if since is not None:
+        return await asyncio.to_thread(headlines_since, tokens, since, max_articles)
+    if not tokens:
+        return {None: [_public_fields(a) for a in headline_store.search([], limit=max_articles)]}
+    # One pass over the index for all tokens.
+    return {token: [_public_fields(a) for a in articles] for token, articles in headline_store.search_each(tokens, limit=max_articles).items()}
 
-    return found_articles[:max_articles]
 
 # Example usage
 if __name__ == "__main__":
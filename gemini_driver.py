@@ -0,0 +1,288 @@
+# gemini_driver.py
+import os
+import re
+import time
+import signal
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+from metrics import FALLBACKS, MODEL_ATTEMPTS, log_event, span
+
+load_dotenv()
+
+# Models to try, in order of preference.
+GEMINI_MODELS = [m.strip() for m in os.getenv("GEMINI_MODELS", "gemini-2.5-pro,gemini-2.5-flash,gemini-1.5-flash").split(",") if m.strip()]
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "300"))
+# Per-model overrides, e.g. "gemini-2.5-pro=240,gemini-1.5-flash=90".
+GEMINI_MODEL_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, _, seconds in (item.partition("=") for item in os.getenv("GEMINI_MODEL_TIMEOUTS", "").split(","))
+    if name.strip() and seconds
+}
+# Seconds to wait on a model before starting the next one in parallel. 0 disables hedging.
+GEMINI_HEDGE_DELAY = float(os.getenv("GEMINI_HEDGE_DELAY", "0"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "3"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "120"))
+
+# Max length of a single stdout line when streaming.
+STREAM_LINE_LIMIT = 1024 * 1024
+
+_STDERR_ERROR_RE = re.compile(r"error|quota|exhausted|\b429\b|\b503\b|unavailable", re.IGNORECASE)
+
+
+class ModelError(Exception):
+    """A single model attempt failed (non-zero exit, timeout or empty output)."""
+
+
+class CircuitBreaker:
+    """
+    Skips models that have failed `threshold` times in a row, for `cooldown` seconds.
+    After the cooldown one attempt is let through; a success closes the breaker again.
+    """
+
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, cooldown: float = GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._opened_at = {}
+
+    def allows(self, model: str) -> bool:
+        opened_at = self._opened_at.get(model)
+        if opened_at is None:
+            return True
+        if time.monotonic() - opened_at >= self.cooldown:
+            # Half-open: let one attempt through; a failure re-opens it for another cooldown.
+            self._opened_at[model] = time.monotonic()
+            return True
+        return False
+
+    def record_success(self, model: str):
+        self._failures.pop(model, None)
+        self._opened_at.pop(model, None)
+
+    def record_failure(self, model: str):
+        self._failures[model] = self._failures.get(model, 0) + 1
+        if self._failures[model] >= self.threshold:
+            self._opened_at[model] = time.monotonic()
+
+
+circuit_breaker = CircuitBreaker()
+
+
+def filter_output(raw_output: str) -> str:
+    """Drops the CLI's `[INFO]` lines and surrounding whitespace."""
+    lines = raw_output.strip().splitlines()
+    return "\n".join(line for line in lines if not line.strip().startswith("[INFO]")).strip()
+
+
+def _kill(proc):
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run_model(model: str, prompt: str, timeout: float, on_stderr_error=None, on_output=None) -> str:
+    """
+    Runs the Gemini CLI for one model and returns its filtered output.
+    With `on_output`, stdout is read line by line and `on_output(text_so_far)` is called
+    as the answer grows, with `[INFO]` lines already dropped.
+    The subprocess is killed if this coroutine times out or is cancelled.
+    """
+    # Own process group, so killing a loser also kills anything the CLI spawned.
+    proc = await asyncio.create_subprocess_exec(
+        "gemini", "--model", model,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=(os.name == "posix"), limit=STREAM_LINE_LIMIT,
+    )
+
+    async def feed_stdin():
+        try:
+            proc.stdin.write(prompt.encode("utf-8"))
+            await proc.stdin.drain()
+        finally:
+            proc.stdin.close()
+
+    async def read_stderr() -> str:
+        seen_error = False
+        lines = []
+        async for raw_line in proc.stderr:
+            line = raw_line.decode("utf-8", errors="replace")
+            lines.append(line)
+            if not seen_error and on_stderr_error and _STDERR_ERROR_RE.search(line):
+                seen_error = True
+                on_stderr_error(model)
+        return "".join(lines)
+
+    async def read_stdout() -> bytes:
+        if not on_output:
+            return await proc.stdout.read()
+        kept = []
+        async for raw_line in proc.stdout:
+            line = raw_line.decode("utf-8", errors="replace")
+            if line.strip().startswith("[INFO]"):
+                continue
+            kept.append(line)
+            text = "".join(kept).strip()
+            if text:
+                on_output(text)
+        return "".join(kept).encode("utf-8")
+
+    async def communicate():
+        _, out, err = await asyncio.gather(feed_stdin(), read_stdout(), read_stderr())
+        await proc.wait()
+        return out, err
+
+    try:
+        stdout, stderr = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise ModelError(f"timed out after {timeout}s")
+    finally:
+        if proc.returncode is None:
+            _kill(proc)
+            await proc.wait()
+
+    if proc.returncode != 0:
+        raise ModelError(f"exited with status {proc.returncode}: {stderr.strip()[-500:]}")
+    output = filter_output(stdout.decode("utf-8", errors="replace"))
+    if not output:
+        raise ModelError("returned an empty response")
+    return output
+
+
+async def _timed_attempt(model: str, *args) -> str:
+    """`run_model`, recorded as a `model_attempt` span and in the attempt counters."""
+    outcome = "error"
+    try:
+        with span("model_attempt", model):
+            output = await run_model(model, *args)
+        outcome = "ok"
+        return output
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        MODEL_ATTEMPTS.inc(model=model, outcome=outcome)
+
+
+async def run_with_fallback(prompt: str, models: list = None, hedge_delay: float = GEMINI_HEDGE_DELAY,
+                            on_fallback=None, on_output=None) -> tuple:
+    """
+    Tries `models` in order and returns `(output, model, fallback_count)`; output is None if all failed.
+
+    Without hedging the next model only starts when the current one fails. With
+    `hedge_delay` > 0 the next model is also started once the current one has run
+    that long or reported an error on stderr; the first non-empty answer wins and
+    every other attempt is killed. Models with an open circuit breaker are skipped.
+
+    With `on_output`, the first model to print anything owns the stream: the other
+    attempts are killed and `on_output(text_so_far)` follows that model. If the owner
+    then fails, the stream restarts with whichever model answers next.
+    """
+    pending = list(models or GEMINI_MODELS)
+    running = {}        # task -> model
+    abandoned = []      # attempts cancelled because another model owns the stream
+    fallback_count = 0
+    wakeup = asyncio.Event()
+    hedge_requested = False
+    stream_owner = None
+    started_any = False
+
+    def request_hedge(_model):
+        nonlocal hedge_requested
+        hedge_requested = True
+        wakeup.set()
+
+    def output_callback(model):
+        def forward(text):
+            nonlocal stream_owner
+            if stream_owner is None:
+                stream_owner = model
+                wakeup.set()
+            if stream_owner == model:
+                on_output(text)
+        return forward
+
+    def start_next() -> bool:
+        """Launches the next model its breaker lets through. Returns False if none is left."""
+        nonlocal started_any
+        while pending:
+            model = pending.pop(0)
+            # Only asked right before launching: a half-open breaker spends its one probe on this call.
+            # If every breaker is open, the last model is still tried rather than giving up outright.
+            if circuit_breaker.allows(model) or (not pending and not started_any):
+                break
+        else:
+            return False
+        started_any = True
+        log_event("model_attempt", logging.DEBUG, model=model)
+        timeout = GEMINI_MODEL_TIMEOUTS.get(model, GEMINI_TIMEOUT)
+        on_stderr_error = request_hedge if hedge_delay > 0 else None
+        forward = output_callback(model) if on_output else None
+        running[asyncio.create_task(_timed_attempt(model, prompt, timeout, on_stderr_error, forward))] = model
+        return True
+
+    def report_fallback(model):
+        nonlocal fallback_count
+        fallback_count += 1
+        FALLBACKS.inc(model=model)
+        if on_fallback:
+            on_fallback(model)
+
+    start_next()
+    try:
+        while running:
+            wakeup_wait = asyncio.create_task(wakeup.wait())
+            timer = hedge_delay if hedge_delay > 0 and pending and stream_owner is None else None
+            done, _ = await asyncio.wait(list(running) + [wakeup_wait], timeout=timer, return_when=asyncio.FIRST_COMPLETED)
+            wakeup_wait.cancel()
+            wakeup.clear()
+
+            for task in done:
+                if task is wakeup_wait:
+                    continue
+                model = running.pop(task)
+                try:
+                    output = task.result()
+                except Exception as e:
+                    log_event("model_failed", logging.WARNING, model=model, error=str(e))
+                    circuit_breaker.record_failure(model)
+                    report_fallback(model)
+                    if stream_owner == model:
+                        stream_owner = None
+                    continue
+                circuit_breaker.record_success(model)
+                log_event("model_succeeded", model=model, fallbacks=fallback_count)
+                return output, model, fallback_count
+
+            if stream_owner is not None:
+                # Someone is already streaming to the user; stop racing against them.
+                for task, model in list(running.items()):
+                    if model != stream_owner:
+                        task.cancel()
+                        running.pop(task)
+                        abandoned.append(task)
+                hedge_requested = False
+                continue
+
+            if not pending:
+                continue
+            if not running:
+                start_next()
+            elif hedge_requested or not done:
+                # The current attempt is slow or erroring: race the next model against it.
+                hedge_requested = False
+                slow_model = list(running.values())[-1]
+                if start_next():
+                    log_event("model_hedged", slow_model=slow_model)
+                    report_fallback(slow_model)
+        return None, None, fallback_count
+    finally:
+        for task in running:
+            task.cancel()
+        if running or abandoned:
+            await asyncio.gather(*running, *abandoned, return_exceptions=True)
@@ -0,0 +1,128 @@
+# llm_scheduler.py
+import os
+import time
+import asyncio
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "3"))
+LLM_MAX_QUEUE_PER_CHAT = int(os.getenv("LLM_MAX_QUEUE_PER_CHAT", "3"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "50"))
+
+
+class QueueFullError(Exception):
+    """Raised by `LLMScheduler.submit` when a chat (or the whole bot) already has too much queued."""
+
+
+def _percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class LLMScheduler:
+    """
+    Runs LLM jobs on a fixed number of workers.
+
+    Each chat has its own FIFO queue and at most one job running at a time, so a
+    chat's messages are answered in order. Workers pick chats round-robin, so one
+    chatty user can't starve everyone else. Must be used from a single event loop.
+    """
+
+    def __init__(self, workers: int = LLM_WORKERS, max_queue_per_chat: int = LLM_MAX_QUEUE_PER_CHAT,
+                 max_queue: int = LLM_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue_per_chat = max_queue_per_chat
+        self.max_queue = max_queue
+
+        self._queues = {}           # chat_id -> deque of (job, future, enqueued_at)
+        self._ready = deque()       # chats with queued work and nothing running, in round-robin order
+        self._running = set()
+        self._wakeup = None
+        self._worker_tasks = []
+
+        self.completed = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=1000)   # recent queue waits in seconds
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    async def submit(self, chat_id, job):
+        """
+        Queues `job` (an async callable) for this chat and returns its result once a worker ran it.
+        Raises QueueFullError instead of queueing when the chat or the bot is saturated.
+        """
+        self._ensure_workers()
+        queue = self._queues.setdefault(chat_id, deque())
+        if len(queue) >= self.max_queue_per_chat or self.queued >= self.max_queue:
+            self.rejected += 1
+            if not queue and chat_id not in self._running:
+                del self._queues[chat_id]
+            raise QueueFullError(f"LLM queue is full for chat {chat_id}")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((job, future, time.monotonic()))
+        if len(queue) == 1 and chat_id not in self._running:
+            self._ready.append(chat_id)
+            self._wakeup.set()
+        return await future
+
+    def stats(self) -> dict:
+        waits = list(self.wait_times)
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "chats_waiting": len(self._ready),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_p50_s": round(_percentile(waits, 0.50), 3),
+            "wait_p95_s": round(_percentile(waits, 0.95), 3),
+            "wait_max_s": round(max(waits, default=0.0), 3),
+        }
+
+    def _ensure_workers(self):
+        if self._worker_tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            while not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            chat_id = self._ready.popleft()
+            queue = self._queues[chat_id]
+            job, future, enqueued_at = queue.popleft()
+            self._running.add(chat_id)
+            self.wait_times.append(time.monotonic() - enqueued_at)
+            try:
+                # The submitter may have given up while waiting; don't spend a worker on it.
+                if not future.done():
+                    result = await job()
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.completed += 1
+                self._running.discard(chat_id)
+                if queue:
+                    self._ready.append(chat_id)   # Back of the line, behind the other chats.
+                else:
+                    self._queues.pop(chat_id, None)
+
+
+llm_scheduler = LLMScheduler()
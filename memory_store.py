@@ -0,0 +1,185 @@
+# memory_store.py
+import os
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+
+def _parse_timestamp(record: dict) -> float:
+    # Timestamps are written with utcnow(), i.e. naive UTC.
+    try:
+        parsed = datetime.fromisoformat(record.get("timestamp", ""))
+    except (TypeError, ValueError):
+        return 0.0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class MemoryStore:
+    """
+    Per-chat conversation memory.
+
+    Every chat gets a bounded ring buffer in RAM, so appends are O(1) and reads only
+    touch the last `max_messages` records. New records are written behind to
+    `memory/{chat_id}.json` (one JSON object per line) by a background thread, and
+    files are periodically compacted down to what's still inside the TTL window.
+    Corrupt lines are skipped one by one instead of discarding the whole history.
+    """
+
+    def __init__(self, directory: str = "memory", max_messages: int = 50, ttl_seconds: int = 86400,
+                 max_chats: int = 1000, flush_interval: float = 2.0, compact_interval: float = 3600.0):
+        self.directory = directory
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self.max_chats = max_chats
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+
+        self._buffers = OrderedDict()   # chat_id -> deque of records, in LRU order
+        self._pending = {}              # chat_id -> records not yet written to disk
+        self._file_lines = {}           # chat_id -> number of lines in the file on disk
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._flusher = None
+        self._last_compaction = time.time()
+        # Which chats this process may compact on disk. Webhook workers narrow this to their own shard.
+        self.owns = lambda chat_id: True
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, chat_id) -> str:
+        return os.path.join(self.directory, f"{chat_id}.json")
+
+    # --- Public API ---
+    def load(self, chat_id) -> list[dict]:
+        """
+        Records for this chat that are still inside the TTL window, oldest first.
+        The first load of a chat reads its file, so call it off the event loop.
+        """
+        chat_id = str(chat_id)
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            buffer = self._buffers.get(chat_id)
+            if buffer is not None:
+                self._buffers.move_to_end(chat_id)
+                return [r for r in buffer if _parse_timestamp(r) >= cutoff]
+
+        # Read the file without holding self._lock, so other chats' appends never wait on disk.
+        # self._io_lock keeps flush() from moving this chat's pending records to disk mid-read.
+        with self._io_lock:
+            records = self._read_file(chat_id)
+            with self._lock:
+                buffer = self._buffers.get(chat_id)
+                if buffer is None:
+                    buffer = deque(records + self._pending.get(chat_id, []), maxlen=self.max_messages)
+                    self._buffers[chat_id] = buffer
+                    while len(self._buffers) > self.max_chats:
+                        self._buffers.popitem(last=False)
+                return [r for r in buffer if _parse_timestamp(r) >= cutoff]
+
+    def append(self, chat_id, role: str, text: str):
+        """Records a message. Never touches the disk, so it's safe to call on the event loop."""
+        chat_id = str(chat_id)
+        record = {"role": role, "text": text.strip(), "timestamp": datetime.utcnow().isoformat()}
+        with self._lock:
+            # A chat that isn't loaded yet picks the record up from _pending (or disk) on its first load.
+            buffer = self._buffers.get(chat_id)
+            if buffer is not None:
+                buffer.append(record)
+                self._buffers.move_to_end(chat_id)
+            self._pending.setdefault(chat_id, []).append(record)
+        self._ensure_flusher()
+
+    def flush(self):
+        """Writes all pending records to disk. Called by the background thread and at exit."""
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            for chat_id, records in pending.items():
+                try:
+                    with open(self.path(chat_id), "a", encoding="utf-8") as f:
+                        f.write("".join(json.dumps(r) + "\n" for r in records))
+                    self._file_lines[chat_id] = self._file_lines.get(chat_id, 0) + len(records)
+                except OSError as e:
+                    print(f"⚠️ Failed to persist memory for chat {chat_id}: {e}")
+
+                # Files that have grown well past the ring buffer get compacted straight away.
+                if self._file_lines.get(chat_id, 0) > 2 * self.max_messages:
+                    self._compact(chat_id)
+
+        if time.time() - self._last_compaction >= self.compact_interval:
+            self.compact_all()
+
+    def compact_all(self):
+        """Rewrites every memory file on disk, dropping expired and corrupt records."""
+        self._last_compaction = time.time()
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") and self.owns(name[:-len(".json")]):
+                # One chat at a time, so a cold load() never waits on the whole sweep.
+                with self._io_lock:
+                    self._compact(name[:-len(".json")])
+
+    # --- Internals ---
+    def _read_file(self, chat_id) -> list[dict]:
+        """Reads the tail of a chat's file, keeping every valid, unexpired record. Caller holds self._io_lock."""
+        path = self.path(chat_id)
+        if not os.path.exists(path):
+            return []
+
+        cutoff = time.time() - self.ttl_seconds
+        records = deque(maxlen=self.max_messages)
+        lines = 0
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and "text" in record and _parse_timestamp(record) >= cutoff:
+                    records.append(record)
+        self._file_lines[chat_id] = lines
+        return list(records)
+
+    def _compact(self, chat_id):
+        # Caller holds self._io_lock. Pending records for this chat are excluded since they're
+        # not on disk yet; they'll be appended by the next flush.
+        with self._lock:
+            pending_ids = {id(r) for r in self._pending.get(chat_id, [])}
+            buffer = self._buffers.get(chat_id)
+            records = [r for r in buffer if id(r) not in pending_ids] if buffer is not None else None
+
+        path = self.path(chat_id)
+        if records is None:
+            records = self._read_file(chat_id)
+
+        cutoff = time.time() - self.ttl_seconds
+        records = [r for r in records if _parse_timestamp(r) >= cutoff]
+        try:
+            if not records:
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(r) + "\n" for r in records))
+                os.replace(tmp_path, path)
+            self._file_lines[chat_id] = len(records)
+        except OSError as e:
+            print(f"⚠️ Failed to compact memory for chat {chat_id}: {e}")
+
+    def _ensure_flusher(self):
+        if self._flusher and self._flusher.is_alive():
+            return
+        self._flusher = threading.Thread(name="memory_flusher", target=self._flush_forever, daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
@@ -0,0 +1,215 @@
+# metrics.py
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# Port for the /metrics endpoint in polling mode (webhook workers use METRICS_PORT + 1 + index). 0 disables it.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Seconds. Covers everything from a token lookup to a multi-minute CLI run.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Correlation ID of the message being handled; follows it into tasks and worker threads.
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def new_request_id() -> str:
+    rid = uuid.uuid4().hex[:12]
+    request_id.set(rid)
+    return rid
+
+
+def with_request_id(job):
+    """Wraps an async callable so it runs under the current request ID, even on another task."""
+    rid = request_id.get()
+
+    async def run():
+        token = request_id.set(rid)
+        try:
+            return await job()
+        finally:
+            request_id.reset(token)
+    return run
+
+
+# --- Structured logging ---
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            "request_id": request_id.get(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+logger = logging.getLogger("coincub")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(_JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """Writes one JSON log line: `{"ts", "level", "event", "request_id", **fields}`."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+# --- Metrics ---
+# name -> metric. Registering a name again replaces the old metric: a spawned webhook worker runs
+# telegram_bot.py as __mp_main__ and then imports it again, and /metrics must not list a name twice.
+REGISTRY = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {round(series[-2], 6)}")
+                lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """A value read from somewhere else (e.g. the scheduler's queue length) when /metrics is scraped."""
+
+    def __init__(self, name: str, help_text: str, read, kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+        REGISTRY[name] = self
+
+    def render(self) -> list[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            log_event("metric_read_failed", logging.WARNING, metric=self.name, error=str(e))
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+
+STAGE_SECONDS = Histogram("coincub_stage_seconds", "Time spent in each stage of handling a message.", ("stage", "detail"))
+REQUESTS = Counter("coincub_requests_total", "Messages handled, by kind of query.", ("kind",))
+ERRORS = Counter("coincub_errors_total", "Errors, by the stage they happened in.", ("stage",))
+FALLBACKS = Counter("coincub_model_fallbacks_total", "Times a model failed or was hedged and the next one was tried.", ("model",))
+MODEL_ATTEMPTS = Counter("coincub_model_attempts_total", "Gemini CLI runs, by model and outcome.", ("model", "outcome"))
+CACHE_LOOKUPS = Counter("coincub_cache_lookups_total", "Analysis cache lookups, by result.", ("status",))
+
+
+@contextmanager
+def span(stage: str, detail: str = ""):
+    """Times the block into `coincub_stage_seconds{stage, detail}` and logs it at debug level."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage, detail=detail)
+        log_event("span", logging.DEBUG, stage=stage, detail=detail, ms=round(elapsed * 1000, 2))
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Serves GET /metrics on its own port from the running event loop. Returns the runner, or None if disabled."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log_event("metrics_server_started", host=host, port=port)
+    return runner
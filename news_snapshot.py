@@ -0,0 +1,139 @@
+# news_snapshot.py
+import os
+import time
+import sqlite3
+import threading
+
+from news_store import index_keys, query_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    published TEXT NOT NULL,
+    published_ts REAL NOT NULL,
+    link TEXT NOT NULL,
+    -- published_ts, or when we first saw it if the feed gave no date; what the history window goes by
+    kept_ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS articles_kept_ts ON articles (kept_ts);
+CREATE TABLE IF NOT EXISTS article_keys (
+    key TEXT NOT NULL,
+    kept_ts REAL NOT NULL,
+    article_id TEXT NOT NULL,
+    PRIMARY KEY (key, kept_ts, article_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS article_keys_kept_ts ON article_keys (kept_ts);
+CREATE TABLE IF NOT EXISTS feeds (
+    source TEXT PRIMARY KEY,
+    etag TEXT,
+    modified TEXT,
+    refreshed_at REAL NOT NULL
+);
+"""
+
+_ARTICLE_COLUMNS = "a.id, a.source, a.title, a.summary, a.published, a.published_ts, a.link"
+
+
+def _row_to_article(row) -> dict:
+    return dict(zip(("id", "source", "title", "summary", "published", "published_ts", "link"), row))
+
+
+class NewsSnapshot:
+    """
+    SQLite copy of every headline seen in the last `history_seconds`, with the same
+    index keys as the in-memory store, plus each feed's ETag/Last-Modified validators.
+
+    A restarted bot reloads it before the first network refresh finishes, and
+    time-ranged questions ("news this week on sol") are answered from it, since the
+    in-memory store only holds the newest entries. Safe to share between threads and,
+    thanks to SQLite's locking, between the webhook worker processes.
+    """
+
+    def __init__(self, path: str, history_seconds: float):
+        self.path = path
+        self.history_seconds = history_seconds
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def save(self, source_name: str, articles: list[dict], etag: str = None, modified: str = None):
+        """Stores new articles from one feed refresh along with the feed's validators."""
+        now = time.time()
+        article_rows, key_rows = [], []
+        for a in articles:
+            kept_ts = a["published_ts"] or now
+            if kept_ts < now - self.history_seconds:
+                continue
+            article_rows.append((a["id"], a["source"], a["title"], a["summary"], a["published"], a["published_ts"], a["link"], kept_ts))
+            key_rows.extend((key, kept_ts, a["id"]) for key in index_keys(f"{a['title']} {a['summary']}"))
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)", article_rows)
+                conn.executemany("INSERT OR IGNORE INTO article_keys VALUES (?, ?, ?)", key_rows)
+                conn.execute("INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?)", (source_name, etag, modified, now))
+
+    def validators(self) -> dict:
+        """`{source: {"etag": ..., "modified": ...}}` as of each feed's last refresh."""
+        with self._lock:
+            rows = self._connect().execute("SELECT source, etag, modified FROM feeds").fetchall()
+        return {source: {"etag": etag, "modified": modified} for source, etag, modified in rows}
+
+    def last_refresh(self) -> float:
+        """When any feed was last refreshed (epoch seconds), or 0.0 if never."""
+        with self._lock:
+            row = self._connect().execute("SELECT MAX(refreshed_at) FROM feeds").fetchone()
+        return row[0] or 0.0
+
+    def recent(self, limit: int) -> list[dict]:
+        """The newest `limit` articles still inside the history window, newest first."""
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {_ARTICLE_COLUMNS} FROM articles a WHERE a.kept_ts >= ? ORDER BY a.kept_ts DESC LIMIT ?",
+                (time.time() - self.history_seconds, limit),
+            ).fetchall()
+        return [_row_to_article(r) for r in rows]
+
+    def search(self, tokens: list[str], since: float, limit: int) -> list[dict]:
+        """Articles published since `since` that mention ALL of `tokens`, newest first."""
+        keys = sorted({query_key(t) for t in tokens if t and t.strip()})
+        if not keys:
+            query = f"SELECT {_ARTICLE_COLUMNS} FROM articles a WHERE a.kept_ts >= ? ORDER BY a.kept_ts DESC LIMIT ?"
+            params = (since, limit)
+        else:
+            placeholders = ", ".join("?" * len(keys))
+            query = (
+                f"SELECT {_ARTICLE_COLUMNS} FROM articles a JOIN ("
+                f"  SELECT article_id, MAX(kept_ts) AS kept_ts FROM article_keys"
+                f"  WHERE key IN ({placeholders}) AND kept_ts >= ?"
+                f"  GROUP BY article_id HAVING COUNT(*) = ?"
+                f") k ON k.article_id = a.id ORDER BY k.kept_ts DESC LIMIT ?"
+            )
+            params = (*keys, since, len(keys), limit)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [_row_to_article(r) for r in rows]
+
+    def prune(self) -> int:
+        """Drops articles that have fallen out of the history window. Returns how many."""
+        cutoff = time.time() - self.history_seconds
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM article_keys WHERE kept_ts < ?", (cutoff,))
+                return conn.execute("DELETE FROM articles WHERE kept_ts < ?", (cutoff,)).rowcount
@@ -0,0 +1,158 @@
+# news_store.py
+import re
+import bisect
+import threading
+import calendar
+from collections import OrderedDict
+
+from coin_list import ALIAS_MAP, MAX_ALIAS_WORDS, canonical_symbol
+
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_DOLLAR_SYMBOL_RE = re.compile(r"\$([a-z0-9]{2,10})\b")
+
+
+def _entry_timestamp(entry) -> float:
+    """Returns the entry's publish time as a UTC epoch, or 0.0 if the feed didn't provide one."""
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    if not parsed:
+        return 0.0
+    try:
+        return float(calendar.timegm(parsed))
+    except (TypeError, ValueError, OverflowError):
+        return 0.0
+
+
+def _entry_id(source_name: str, entry) -> str:
+    """Stable identity for an entry so the same article isn't stored twice across refreshes."""
+    return entry.get("id") or entry.get("link") or f"{source_name}:{entry.get('title', '')}"
+
+
+def article_from_entry(source_name: str, entry) -> dict:
+    """The fields we keep from a parsed feed entry."""
+    return {
+        "id": _entry_id(source_name, entry),
+        "source": source_name,
+        "title": entry.get("title", "").strip(),
+        "summary": entry.get("summary", ""),
+        "published": entry.get("published", "").strip(),
+        "published_ts": _entry_timestamp(entry),
+        "link": entry.get("link", "").strip(),
+    }
+
+
+def index_keys(text: str) -> set[str]:
+    """
+    All index keys for a piece of text: normalized words, `$symbol` mentions,
+    and the canonical symbol of every known coin name/alias (e.g. 'bitcoin' -> 'btc').
+    """
+    text = _HTML_TAG_RE.sub(" ", text).lower()
+    words = _WORD_RE.findall(text)
+    keys = set(words)
+    keys.update(f"${s}" for s in _DOLLAR_SYMBOL_RE.findall(text))
+
+    # Longest-first n-gram scan so multi-word names like "shiba inu" are picked up too.
+    for i in range(len(words)):
+        for n in range(min(MAX_ALIAS_WORDS, len(words) - i), 0, -1):
+            symbol = ALIAS_MAP.get(tuple(words[i:i + n]))
+            if symbol:
+                keys.add(symbol)
+                break
+    return keys
+
+
+def query_key(token: str) -> str:
+    """Normalizes a user token to the key it should be looked up under."""
+    token = token.lower().strip()
+    return canonical_symbol(token) or token.lstrip("$")
+
+
+class HeadlineStore:
+    """
+    Bounded, de-duplicated, thread-safe store of parsed feed entries.
+    The RSS poller writes into it, `fetch_token_headlines` reads from it.
+
+    Entries are indexed as they're ingested: every key maps to a posting list
+    kept sorted newest-first, so lookups never rescan the article text.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._postings = {}      # key -> sorted list of (-published_ts, entry_id)
+        self._entry_keys = {}    # entry_id -> keys it's indexed under, for eviction
+        self._lock = threading.Lock()
+        self.last_refresh = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add_articles(self, articles: list[dict]) -> list[dict]:
+        """Adds already-parsed articles (see `article_from_entry`), skipping known ones. Returns the new ones."""
+        added = []
+        with self._lock:
+            for article in articles:
+                if article["id"] in self._entries:
+                    continue
+                self._entries[article["id"]] = article
+                self._index(article)
+                added.append(article)
+
+            # Evict the oldest insertions once we're over the bound.
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._unindex(evicted)
+        return added
+
+    def _index(self, article: dict):
+        keys = index_keys(f"{article['title']} {article['summary']}")
+        posting = (-article["published_ts"], article["id"])
+        for key in keys:
+            bisect.insort(self._postings.setdefault(key, []), posting)
+        self._entry_keys[article["id"]] = keys
+
+    def _unindex(self, article: dict):
+        posting = (-article["published_ts"], article["id"])
+        for key in self._entry_keys.pop(article["id"], ()):
+            postings = self._postings.get(key)
+            if not postings:
+                continue
+            i = bisect.bisect_left(postings, posting)
+            if i < len(postings) and postings[i] == posting:
+                postings.pop(i)
+            if not postings:
+                del self._postings[key]
+
+    def articles(self) -> list[dict]:
+        """Snapshot of all stored articles, newest first."""
+        with self._lock:
+            items = list(self._entries.values())
+        return sorted(items, key=lambda a: a["published_ts"], reverse=True)
+
+    def search_each(self, tokens: list[str], limit: int = None) -> dict:
+        """`{token: newest articles mentioning it}` for several tokens, under a single lock acquisition."""
+        keys = {token: query_key(token) for token in tokens}
+        with self._lock:
+            return {
+                token: [self._entries[entry_id] for _, entry_id in self._postings.get(key, [])[:limit]]
+                for token, key in keys.items()
+            }
+
+    def search(self, tokens: list[str], limit: int = None) -> list[dict]:
+        """
+        Articles mentioning ALL of the given tokens, newest first.
+        A single token walks its pre-sorted posting list; several tokens intersect them.
+        """
+        keys = [query_key(t) for t in tokens if t and t.strip()]
+        if not keys:
+            return self.articles()[:limit]
+
+        with self._lock:
+            postings = [self._postings.get(k, []) for k in keys]
+            if len(postings) == 1:
+                hits = postings[0][:limit]
+            else:
+                postings.sort(key=len)
+                common = set.intersection(*(set(p) for p in postings))
+                hits = [p for p in postings[0] if p in common][:limit]
+            return [self._entries[entry_id] for _, entry_id in hits]
@@ -0,0 +1,129 @@
+# prefetch.py
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dotenv import load_dotenv
+
+from fetch_rss import fetch_headlines_async, headlines_to_markdown
+from gemini_query import get_gemini_analysis_async
+from llm_scheduler import llm_scheduler, QueueFullError
+from metrics import log_event
+from response_cache import analysis_cache, analysis_cache_key, analysis_query
+
+load_dotenv()
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") not in ("0", "false", "False", "")
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "5"))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "60"))
+PREFETCH_HALF_LIFE = float(os.getenv("PREFETCH_HALF_LIFE", "1800"))
+PREFETCH_MAX_PER_HOUR = int(os.getenv("PREFETCH_MAX_PER_HOUR", "20"))
+# Only prefetch while fewer than this many LLM jobs are running or queued for real users.
+PREFETCH_MAX_LOAD = int(os.getenv("PREFETCH_MAX_LOAD", "1"))
+# Tokens need at least this much (decayed) interest before we spend an LLM run on them.
+PREFETCH_MIN_SCORE = float(os.getenv("PREFETCH_MIN_SCORE", "2"))
+
+# The scheduler queue the prefetcher submits under, so it's served fairly alongside real chats.
+PREFETCH_CHAT_ID = "prefetch"
+
+
+class DecayingCounter:
+    """Per-token request counts that halve every `half_life` seconds, so recent interest dominates."""
+
+    def __init__(self, half_life: float = PREFETCH_HALF_LIFE):
+        self.half_life = half_life
+        self._scores = {}   # token -> (score, last_update)
+
+    def _decayed(self, score: float, last_update: float, now: float) -> float:
+        return score * 0.5 ** ((now - last_update) / self.half_life)
+
+    def record(self, token: str, weight: float = 1.0):
+        now = time.monotonic()
+        score, last_update = self._scores.get(token, (0.0, now))
+        self._scores[token] = (self._decayed(score, last_update, now) + weight, now)
+
+    def top_k(self, k: int) -> list[tuple]:
+        """The `k` hottest tokens as `(token, score)`, hottest first. Forgets tokens that have gone cold."""
+        now = time.monotonic()
+        scored = {t: self._decayed(s, u, now) for t, (s, u) in self._scores.items()}
+        for token in [t for t, s in scored.items() if s < 0.01]:
+            del self._scores[token]
+        return sorted(((t, s) for t, s in scored.items() if s >= 0.01), key=lambda item: item[1], reverse=True)[:k]
+
+
+class Prefetcher:
+    """
+    Keeps analyses for the hottest tokens warm in the response cache.
+
+    Every `interval` seconds, if real users aren't keeping the LLM workers busy, it
+    refreshes headlines for the top-K tokens and pre-computes any single-token
+    analysis that isn't already cached, spending at most `max_per_hour` LLM runs.
+    """
+
+    def __init__(self, top_k: int = PREFETCH_TOP_K, interval: float = PREFETCH_INTERVAL,
+                 max_per_hour: int = PREFETCH_MAX_PER_HOUR):
+        self.top_k = top_k
+        self.interval = interval
+        self.max_per_hour = max_per_hour
+        self.counter = DecayingCounter()
+        self.warmed = 0
+        self._runs = deque()    # monotonic timestamps of LLM runs in the last hour
+        self._task = None
+
+    def record(self, tokens: list):
+        for token in tokens:
+            self.counter.record(token)
+
+    def ensure_started(self):
+        if PREFETCH_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                log_event("prefetch_failed", logging.WARNING, error=str(e))
+
+    def _budget_left(self) -> int:
+        cutoff = time.monotonic() - 3600
+        while self._runs and self._runs[0] < cutoff:
+            self._runs.popleft()
+        return self.max_per_hour - len(self._runs)
+
+    def _off_peak(self) -> bool:
+        return llm_scheduler.running + llm_scheduler.queued < PREFETCH_MAX_LOAD
+
+    async def run_once(self):
+        hot = [token for token, score in self.counter.top_k(self.top_k) if score >= PREFETCH_MIN_SCORE]
+        if not hot:
+            return
+        # Same fan-out and formatting as the bot's single-token path, so the cache keys match.
+        headlines_by_token = await fetch_headlines_async(hot, max_articles=6)
+
+        for token in hot:
+            if self._budget_left() <= 0 or not self._off_peak():
+                return
+            news_md = headlines_to_markdown(headlines_by_token[token])
+            key = analysis_cache_key([token], news_md)
+            if analysis_cache.get(key) is not None:
+                continue
+
+            self._runs.append(time.monotonic())
+            try:
+                _, status = await analysis_cache.get_or_compute(
+                    key,
+                    lambda: llm_scheduler.submit(PREFETCH_CHAT_ID, lambda: get_gemini_analysis_async(
+                        [token], news_md, analysis_query([token]), None, [])),
+                    cacheable=lambda r: "❌" not in r,
+                )
+            except QueueFullError:
+                return
+            if status == "miss":
+                self.warmed += 1
+                log_event("prefetch_warmed", token=token)
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,191 @@
+# prompt_builder.py
+import os
+import threading
+from string import Template
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt", "GEMINI.md")
+# Upper bound on the whole prompt. News and history are trimmed to fit; the base prompt never is.
+PROMPT_MAX_CHARS = int(os.getenv("PROMPT_MAX_CHARS", "24000"))
+PROMPT_MAX_QUERY_CHARS = int(os.getenv("PROMPT_MAX_QUERY_CHARS", "1000"))
+PROMPT_MAX_MESSAGE_CHARS = int(os.getenv("PROMPT_MAX_MESSAGE_CHARS", "1500"))
+
+
+class PromptError(Exception):
+    """The base prompt file is missing or unusable."""
+
+
+class BasePrompt:
+    """
+    `prompt/GEMINI.md`, read once and cached. The file's mtime is checked on each
+    access so edits are picked up without a restart; if an edited file turns out
+    to be invalid the last good version keeps being served.
+    """
+
+    def __init__(self, path: str = PROMPT_PATH):
+        self.path = path
+        self._text = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._text is None:
+                raise PromptError(f"The '{os.path.relpath(self.path)}' file was not found.")
+            return self._text
+
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._reload(mtime)
+        return self._text
+
+    def _reload(self, mtime: float):
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        if not text.strip():
+            if self._text is None:
+                raise PromptError(f"The '{os.path.relpath(self.path)}' file is empty.")
+            print(f"⚠️ Ignoring empty {self.path}; keeping the previous prompt.")
+        else:
+            self._text = text
+        self._mtime = mtime
+
+
+SINGLE_TOKEN_TEMPLATE = Template("""
+---
+## Current Task
+- **Analyze this token:** $token
+- **Recent News:**
+$news
+- **User History:** $history
+- **User's Query:** "$query"
+
+**Your Instructions:** Perform a full analysis of **$token**, synthesizing MCP data with the **Relevant News** provided. Follow your core rules in `GEMINI.md`.
+""")
+
+COMPARE_TEMPLATE = Template("""
+---
+## Current Task: Compare Two Tokens
+- **Tokens to Compare:** $token1 vs $token2
+- **Relevant News Context:**
+$news
+- **User's Query:** "$query"
+- **User History:** $history
+
+**YOUR IMMEDIATE INSTRUCTIONS:**
+1.  **Use your MCP tools** to get the key metrics (Price, Market Cap, Volume, 7D Volatility, and Liquidity) for **both $token1 and $token2**.
+2.  **You MUST generate a Markdown comparison table** using this data, exactly as defined in your core rules.
+3.  After the table, **you MUST provide a one-line summary** that compares their stability and risk, use the **Relevant News Context** to inform your final summary statement about risk and stability.
+
+""")
+
+BATCH_TEMPLATE = Template("""
+---
+## Current Task: Compare $count Tokens
+- **Tokens to Compare:** $tokens
+- **Relevant News Context** (each line is tagged with the token it's about):
+$news
+- **User's Query:** "$query"
+- **User History:** $history
+
+**YOUR IMMEDIATE INSTRUCTIONS:**
+1.  **Use your MCP tools** to get the key metrics (Price, Market Cap, Volume, 7D Volatility, and Liquidity) for **every one of: $tokens**.
+2.  **You MUST generate ONE compact Markdown table with one row per token** and the columns: Token | Price | Market Cap | Volume | 7D Volatility | Liquidity (🟢 / ⚠️ / ❌).
+3.  After the table, **you MUST provide a one-line risk and stability note for each token**, using the **Relevant News Context** tagged with that token where there is any.
+
+""")
+
+GENERAL_TEMPLATE = Template("""
+---
+## Current Task
+- **This is a general conversational query.** Do not assume it's about a specific token unless mentioned.
+- **General Market News Pulse:**
+$news
+- **User History:**
+$history
+- **User's Query:** "$query"
+
+**Your Instructions:** Follow your core rules for General Conversation. Analyze the user history for context. **Do NOT call any MCP tools unless the user explicitly asks for new data.** Provide a helpful, conversational response.
+""")
+
+SAFETY_NET_PROMPT = """
+---
+## ABSOLUTE SAFETY RULE
+You have many tools. Sometimes you might choose one that requires an 'interval'.
+**IF AND ONLY IF you call a tool that needs an `interval` parameter, you MUST use `"interval": "1d"`.**
+This is your only fallback. Your primary goal is to use the tools as described in your main instructions (e.g., for snapshots or comparisons). This rule is to prevent an error if you deviate.
+""".strip()
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:max(limit - 1, 0)] + "…"
+
+
+def _fit_lines(lines: list[str], budget: int, keep_recent_last: bool = False) -> str:
+    """
+    Joins as many whole lines as fit in `budget` characters. News is ordered newest
+    first, so it keeps the head; history is oldest first, so it keeps the tail.
+    """
+    ordered = reversed(lines) if keep_recent_last else lines
+    kept, used = [], 0
+    for line in ordered:
+        cost = len(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if keep_recent_last:
+        kept.reverse()
+    return "\n".join(kept)
+
+
+def format_memory_lines(memory: list) -> list[str]:
+    return [
+        _truncate(f"User: {m['text']}" if m['role'] == 'user' else f"You: {m['text']}", PROMPT_MAX_MESSAGE_CHARS)
+        for m in memory
+    ]
+
+
+class PromptBuilder:
+    """Assembles the final prompt from the cached base prompt, a task template and a size budget."""
+
+    def __init__(self, base_prompt: BasePrompt = None, max_chars: int = PROMPT_MAX_CHARS):
+        self.base_prompt = base_prompt or BasePrompt()
+        self.max_chars = max_chars
+
+    def build(self, tokens: list, news_md: str, user_query: str, memory: list) -> str:
+        base = self.base_prompt.get()
+        template, fields = self._template_for(tokens)
+        fields["query"] = _truncate(user_query, PROMPT_MAX_QUERY_CHARS)
+
+        # Everything except news and history is fixed; those two share what's left.
+        skeleton = template.substitute(fields, news="", history="")
+        available = max(self.max_chars - len(base) - len(skeleton) - len(SAFETY_NET_PROMPT) - 2, 0)
+
+        news_lines = news_md.splitlines()
+        memory_lines = format_memory_lines(memory)
+        memory_need = sum(len(line) + 1 for line in memory_lines)
+        # News comes first, but is guaranteed at most half the budget if history needs the rest.
+        news = _fit_lines(news_lines, max(available - memory_need, available // 2))
+        history = _fit_lines(memory_lines, available - len(news), keep_recent_last=True)
+
+        task_specific_prompt = template.substitute(fields, news=news, history=history)
+        return base + "\n" + task_specific_prompt.strip() + "\n" + SAFETY_NET_PROMPT
+
+    @staticmethod
+    def _template_for(tokens: list) -> tuple:
+        if len(tokens) == 1:
+            return SINGLE_TOKEN_TEMPLATE, {"token": tokens[0]}
+        if len(tokens) == 2:
+            return COMPARE_TEMPLATE, {"token1": tokens[0], "token2": tokens[1]}
+        if len(tokens) > 2:
+            return BATCH_TEMPLATE, {"count": len(tokens), "tokens": ", ".join(t.upper() for t in tokens)}
+        return GENERAL_TEMPLATE, {}
+
+
+prompt_builder = PromptBuilder()
@@ -0,0 +1,119 @@
+# query_log.py
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "logs/query_log.jsonl")
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+QUERY_LOG_ROTATE_SECONDS = int(os.getenv("QUERY_LOG_ROTATE_SECONDS", "86400"))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+
+
+class QueryLog:
+    """
+    Append-only, rotating JSONL log of answered queries.
+
+    Callers only put entries on a queue; a single writer thread owns the file, so
+    concurrent `asyncio.to_thread` workers never race each other. The file is rotated
+    to `.1`, `.2`, ... once it exceeds `max_bytes` or is older than `rotate_seconds`.
+    """
+
+    def __init__(self, path: str = QUERY_LOG_PATH, max_bytes: int = QUERY_LOG_MAX_BYTES,
+                 rotate_seconds: int = QUERY_LOG_ROTATE_SECONDS, backups: int = QUERY_LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self._queue = queue.Queue()
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._opened_at = None
+
+    def write(self, entry: dict):
+        """Queues one entry for the writer thread. Never blocks on disk I/O."""
+        self._ensure_writer()
+        self._queue.put(entry)
+
+    def close(self):
+        """Drains everything queued so far. Registered to run at exit."""
+        if self._writer and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+
+    def _ensure_writer(self):
+        if self._writer and self._writer.is_alive():
+            return
+        with self._start_lock:
+            if self._writer and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(name="query_log_writer", target=self._run, daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            # Pick up whatever else is already queued so a burst becomes one write.
+            while not self._queue.empty():
+                entry = self._queue.get_nowait()
+                if entry is None:
+                    self._append(batch)
+                    return
+                batch.append(entry)
+            self._append(batch)
+
+    def _append(self, batch: list[dict]):
+        try:
+            self._rotate_if_needed()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in batch))
+        except Exception as e:
+            print(f"⚠️ Logging failed:", e)
+
+    def _rotate_if_needed(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self._opened_at = None
+            return
+
+        # The file's age is taken from its first entry; st_ctime isn't creation time everywhere.
+        if self._opened_at is None:
+            self._opened_at = self._first_logged_at() or time.time()
+        if size < self.max_bytes and time.time() - self._opened_at < self.rotate_seconds:
+            return
+
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._opened_at = None
+
+    def _first_logged_at(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return float(json.loads(f.readline()).get("logged_at"))
+        except Exception:
+            return None
+
+
+query_log = QueryLog()
+
+
+def log_query(chat_id, entry: dict):
+    """Records one answered query. Safe to call from any thread."""
+    query_log.write({"chat_id": str(chat_id), "logged_at": time.time(), **entry})
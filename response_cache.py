@@ -0,0 +1,121 @@
+# response_cache.py
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from coin_list import canonical_symbol
+
+load_dotenv()
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "120"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache for finished analyses, with request coalescing: while one call
+    for a key is in flight, identical requests wait on it instead of starting their own.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, ttl_seconds: int = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires_at, value), in LRU order
+        self._inflight = {}             # key -> Future shared by coalesced callers
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key, compute, cacheable=lambda value: True):
+        """
+        Returns `(value, status)` where status is "hit", "coalesced" or "miss".
+        `compute` is an async callable; its result is only stored if `cacheable(result)`.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, "hit"
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight), "coalesced"
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Mark as retrieved in case nobody else was waiting.
+            raise
+        else:
+            if cacheable(value):
+                self.put(key, value)
+            future.set_result(value)
+            return value, "miss"
+        finally:
+            self._inflight.pop(key, None)
+
+
+def task_type(tokens: list) -> str:
+    if len(tokens) == 1:
+        return "single"
+    if len(tokens) == 2:
+        return "compare"
+    if len(tokens) > 2:
+        return "batch"
+    return "general"
+
+
+def analysis_cache_key(tokens: list, news_md: str):
+    """
+    Key for a token analysis: the token set, the task type and a hash of the news snapshot.
+    Per-chat history and query wording are deliberately left out, so everyone asking
+    about the same tokens against the same news shares one answer.
+    """
+    news_hash = hashlib.sha1(news_md.encode("utf-8")).hexdigest()
+    symbols = sorted(canonical_symbol(t) or t.lower().lstrip("$") for t in tokens)
+    return (tuple(symbols), task_type(tokens), news_hash)
+
+
+def analysis_query(tokens: list) -> str:
+    """
+    The query a shareable token analysis is built from. Like the key, it depends only on
+    the tokens, so nothing from the chat that happened to ask first ends up in the answer.
+    """
+    if len(tokens) == 1:
+        return f"Give me a full analysis of {tokens[0]}"
+    names = [t.upper() for t in tokens]
+    return f"Compare {', '.join(names[:-1])} and {names[-1]}"
+
+
+analysis_cache = ResponseCache()
@@ -1,64 +1,60 @@
 import os
-import json
+import time
 import asyncio
+import logging
 from datetime import datetime
 from telegram import Update
-from telegram.constants import ParseMode, ChatAction
+from telegram.constants import ChatAction
 from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, ContextTypes, filters
-from telegram.helpers import escape_markdown
 from dotenv import load_dotenv
 
-# These imports are for the keep-alive web server
-# from flask import Flask
-# from threading import Thread
-
 # Import custom modules
-from fetch_rss import fetch_token_headlines
-from extract_token import extract_token_name_symbol
-from gemini_query import get_gemini_analysis
+from fetch_rss import (ensure_headlines_loaded, fetch_headlines_async, headline_store, headlines_to_markdown,
+                       headlines_to_markdown_by_token, start_rss_poller)
+from extract_token import extract_time_window, extract_token_name_symbol, names_only
+from gemini_query import get_gemini_analysis_async
+from llm_scheduler import llm_scheduler, QueueFullError
+from memory_store import MemoryStore
+from metrics import (CACHE_LOOKUPS, ERRORS, REQUESTS, STAGE_SECONDS, CallbackMetric, log_event, new_request_id, span,
+                     start_metrics_server, with_request_id)
+from prefetch import prefetcher
+from telegram_output import clean_response, send_chunks
+from telegram_stream import StreamingReply, STREAM_RESPONSES
+from query_log import log_query
+from response_cache import analysis_cache, analysis_cache_key, analysis_query, task_type
 
 load_dotenv()
 COINCUB_BOT_TOKEN = os.getenv("COINCUB_BOT_TOKEN")
+# "polling" runs a single process; "webhook" runs webhook_server with sharded worker processes.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# "/ask btc eth sol ..." compares up to this many tokens in one model run; extra ones are dropped.
+BATCH_MAX_TOKENS = int(os.getenv("BATCH_MAX_TOKENS", "5"))
+BATCH_NEWS_PER_TOKEN = int(os.getenv("BATCH_NEWS_PER_TOKEN", "2"))
 
 # Helper Functions
 os.makedirs("memory", exist_ok=True); os.makedirs("logs", exist_ok=True)
-def get_memory_path(chat_id): return f"memory/{chat_id}.json"
+memory_store = MemoryStore(
+    "memory",
+    max_messages=int(os.getenv("MEMORY_MAX_MESSAGES", "50")),
+    ttl_seconds=int(os.getenv("MEMORY_TTL_SECONDS", "86400")),
+)
+def get_memory_path(chat_id): return memory_store.path(chat_id)
 def load_memory(chat_id):
-    if not os.path.exists(get_memory_path(chat_id)): return []
-    with open(get_memory_path(chat_id), "r", encoding="utf-8") as f:
-        try:
-            return [json.loads(line) for line in f if (datetime.utcnow() - datetime.fromisoformat(json.loads(line).get("timestamp", "1970-01-01T00:00:00.000000"))).total_seconds() < 86400]
-        except (json.JSONDecodeError, TypeError): return []
+    with span("memory_load"): return memory_store.load(chat_id)
 def save_memory(chat_id, role, text):
-    with open(get_memory_path(chat_id), "a", encoding="utf-8") as f: f.write(json.dumps({"role": role, "text": text.strip(), "timestamp": datetime.utcnow().isoformat()}) + "\n")
-def clean_response(text: str) -> str:
-    return "\n".join([line for line in text.splitlines() if not any(k in line.lower() for k in [".env", "readme", ".py", "working directory"])])
-chat_queues = {}
-
-# Keep-Alive Web Server for Deployment
-# app = Flask('')
+    with span("memory_save"): memory_store.append(chat_id, role, text)
 
-# @app.route('/')
-# def home():
-#     return "CoinCub is alive!"
-
-# def run_web_server():
-#   app.run(host='0.0.0.0', port=8080)
-
-# def keep_alive():
-#     t = Thread(name='keep_alive_thread', target=run_web_server)
-#     t.daemon = True
-#     t.start()
+# Exported on /metrics alongside the counters and stage timings.
+CallbackMetric("coincub_llm_running", "Gemini CLI jobs running right now.", lambda: llm_scheduler.running)
+CallbackMetric("coincub_llm_queued", "Gemini CLI jobs waiting for a worker.", lambda: llm_scheduler.queued)
+CallbackMetric("coincub_llm_rejected_total", "Requests turned away because the LLM queue was full.", lambda: llm_scheduler.rejected, "counter")
+CallbackMetric("coincub_llm_wait_p95_seconds", "95th percentile of recent LLM queue waits.", lambda: llm_scheduler.stats()["wait_p95_s"])
+CallbackMetric("coincub_cached_analyses", "Analyses currently held in the response cache.", lambda: len(analysis_cache))
+CallbackMetric("coincub_headlines", "Headlines held in the news store.", lambda: len(headline_store))
 
 # Telegram Bot Functions 
 async def send_safe_reply(update: Update, text: str):
-    cleaned_text = clean_response(str(text))
-    try:
-        for i in range(0, len(cleaned_text), 4096):
-            await update.message.reply_text(escape_markdown(cleaned_text[i:i+4096], version=2), parse_mode=ParseMode.MARKDOWN_V2)
-    except Exception as e:
-        print(f"❌ Failed to send reply with markdown: {e}")
-        await update.message.reply_text(cleaned_text)
+    await send_chunks(update.message, str(text))
 
 # Core logic refactored into a reusable function
 async def handle_analysis_query(user_query: str, current_update: Update):
@@ -67,6 +63,9 @@ async def handle_analysis_query(user_query: str, current_update: Update):
         await send_safe_reply(current_update, "Please provide a token or question after the command. Example: `/ask btc`")
         return
 
+    # Every log line and span for this message carries the same request ID.
+    new_request_id()
+    started_at = time.perf_counter()
     chat_id = current_update.effective_chat.id
     save_memory(chat_id, "user", user_query)
 
@@ -89,41 +88,91 @@ async def handle_analysis_query(user_query: str, current_update: Update):
             await send_safe_reply(current_update, message)
     
     response = ""
+    stream = None
     try:
+        # Start warming the news store right away; it runs while we extract tokens and load memory.
+        news_ready = asyncio.create_task(ensure_headlines_loaded())
         tokens = extract_token_name_symbol(user_query)
-        memory = load_memory(chat_id)
-        
-        loop = asyncio.get_running_loop()
-        def thread_safe_callback(model_name):
-            asyncio.run_coroutine_threadsafe(send_fallback_notification(model_name), loop)
+        if len(tokens) > BATCH_MAX_TOKENS:
+            dropped, tokens = tokens[BATCH_MAX_TOKENS:], tokens[:BATCH_MAX_TOKENS]
+            await send_safe_reply(current_update, f"ℹ️ I can compare up to {BATCH_MAX_TOKENS} tokens at once, so I'm leaving out: {', '.join(t.upper() for t in dropped)}.")
+        REQUESTS.inc(kind=task_type(tokens))
+        # "news this week on sol" looks back a week in the stored history instead of at the latest headlines.
+        window = extract_time_window(user_query)
+        since = time.time() - window if window else None
+        # Popular tokens get their analyses pre-computed while the bot is idle.
+        prefetcher.record(tokens)
+        prefetcher.ensure_started()
+        memory, _ = await asyncio.gather(asyncio.to_thread(load_memory, chat_id), news_ready)
+
+        # Keep a reference to each notice until it's sent, or it could be garbage-collected mid-flight.
+        notice_tasks = set()
+        def fallback_callback(model_name):
+            task = asyncio.create_task(send_fallback_notification(model_name))
+            notice_tasks.add(task)
+            task.add_done_callback(notice_tasks.discard)
+
+        # Show the answer as it's generated instead of after the whole CLI run.
+        stream = StreamingReply(current_update.message) if STREAM_RESPONSES else None
+        def stream_callback(text):
+            typing_task.cancel()
+            stream.update(clean_response(text))
 
         news_md = ""
-        if len(tokens) == 1:
-            headlines = fetch_token_headlines(tokens[0], max_articles=6)
-            news_md = "\n".join([f"- “{n['title']}” — {n['source']}, {n['published']}" for n in headlines]) or "No relevant news found."
-            response = await asyncio.to_thread(get_gemini_analysis, tokens, news_md, user_query, chat_id, memory, fallback_callback=thread_safe_callback)
-        elif len(tokens) == 2:
-            all_headlines = [h for t in tokens for h in fetch_token_headlines(t, max_articles=3)]
-            news_md = "\n".join([f"- “{n['title']}” — {n['source']}, {n['published']}" for n in all_headlines]) or "No relevant news found."
-            response = await asyncio.to_thread(get_gemini_analysis, tokens, news_md, user_query, chat_id, memory, fallback_callback=thread_safe_callback)
+        if tokens:
+            # Headlines for every token are gathered in one pass over the index.
+            max_articles = {1: 6, 2: 3}.get(len(tokens), BATCH_NEWS_PER_TOKEN)
+            headlines_by_token = await fetch_headlines_async(tokens, max_articles=max_articles, since=since)
+            if len(tokens) <= 2:
+                news_md = headlines_to_markdown([h for t in tokens for h in headlines_by_token[t]])
+            else:
+                # Several tokens share one prompt, so each gets a fair slice of the news budget.
+                news_md = headlines_to_markdown_by_token(headlines_by_token)
+            if since is None and names_only(user_query, tokens):
+                # Just naming tokens: every chat asking about them gets one shared analysis, built
+                # without this chat's history or wording (same as the prefetcher's).
+                response, cache_status = await analysis_cache.get_or_compute(
+                    analysis_cache_key(tokens, news_md),
+                    lambda: llm_scheduler.submit(chat_id, with_request_id(lambda: get_gemini_analysis_async(tokens, news_md, analysis_query(tokens), chat_id, [], fallback_callback=fallback_callback, stream_callback=stream_callback if stream else None))),
+                    cacheable=lambda r: "❌" not in r,
+                )
+                if cache_status != "miss":
+                    log_query(chat_id, {"timestamp": datetime.utcnow().isoformat(), "query": user_query, "response": response[:4000],
+                                        "latency_ms": 0, "model": f"cache:{cache_status}", "fallbacks": 0})
+            else:
+                # A real question about the tokens ("should I sell my eth?", "news this week on sol")
+                # needs its own wording and this chat's history, so it isn't shared.
+                cache_status = "bypass"
+                response = await llm_scheduler.submit(chat_id, with_request_id(lambda: get_gemini_analysis_async(tokens, news_md, user_query, chat_id, memory, fallback_callback=fallback_callback, stream_callback=stream_callback if stream else None)))
+            CACHE_LOOKUPS.inc(status=cache_status)
         else:
-            general_headlines = fetch_token_headlines(token_name_or_symbol=None, max_articles=6)
-            news_md = "\n".join([f"- “{n['title']}” — {n['source']}, {n['published']}" for n in general_headlines]) or "No general news found."
-            response = await asyncio.to_thread(get_gemini_analysis, [], news_md, user_query, chat_id, memory, fallback_callback=thread_safe_callback)
-    
+            # General questions are conversational and lean on history, so they bypass the cache.
+            general_headlines = (await fetch_headlines_async([], max_articles=6, since=since))[None]
+            news_md = headlines_to_markdown(general_headlines, "No general news found.")
+            response = await llm_scheduler.submit(chat_id, with_request_id(lambda: get_gemini_analysis_async([], news_md, user_query, chat_id, memory, fallback_callback=fallback_callback, stream_callback=stream_callback if stream else None)))
+
+    except QueueFullError:
+        ERRORS.inc(stage="queue_full")
+        response = "🐢 I'm handling a lot of requests right now. Please try again in a minute."
     except Exception as e:
-        print(f"❌ An error occurred in handle_analysis_query: {e}"); response = "😵 Sorry, a general error occurred."
+        ERRORS.inc(stage="handler")
+        log_event("handler_failed", logging.ERROR, chat_id=chat_id, error=str(e)); response = "😵 Sorry, a general error occurred."
     finally:
         typing_task.cancel()
 
     save_memory(chat_id, "assistant", response)
 
-    if "❌" not in response:
+    if stream and stream.started:
+        # Already on screen; just make sure it ends with the final (or error) text.
+        await stream.finish(clean_response(response))
+    elif "❌" not in response:
         await send_safe_reply(current_update, response)
     elif "❌" in response and not fallback_notification_sent:
          await send_safe_reply(current_update, response)
 
-    print(f"✅ Response successfully sent to chat_id: {chat_id}")
+    elapsed = time.perf_counter() - started_at
+    STAGE_SECONDS.observe(elapsed, stage="request")
+    log_event("response_sent", chat_id=chat_id, ms=round(elapsed * 1000, 1))
 
 # Command Handlers 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -134,6 +183,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Example Commands:\n"
         "🔹 `/ask btc` - Get a full analysis of Bitcoin.\n"
         "🔹 `/ask eth vs sol` - Compare Ethereum and Solana.\n"
+        "🔹 `/ask btc eth sol` - Compare several tokens in one table.\n"
         "🔹 `/ask what is trending?` - Get the latest market trends.\n\n"
         "Type `/help` to see all available commands."
     )
@@ -149,7 +199,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "`/ask What is the latest on Dogecoin?`\n"
         "`/ask price of $ETH`\n\n"
         "2️⃣ Token Comparison:\n"
-        "`/ask compare avax vs sui`\n\n"
+        "`/ask compare avax vs sui`\n"
+        "`/ask btc eth sol link` (up to " + str(BATCH_MAX_TOKENS) + " tokens in one table)\n\n"
         "3️⃣ General Questions:\n"
         "`/ask what are the top gainers today?`\n\n"
         "--- \n"
@@ -171,13 +222,14 @@ async def private_text_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     user_query = update.message.text
     await handle_analysis_query(user_query, update)
 
-def run_bot():
-    # Starts the keep-alive web server before the bot starts polling
-    # keep_alive() 
+def build_application(with_updater: bool = True):
+    """Creates the Telegram application with all handlers registered."""
+    builder = ApplicationBuilder().token(COINCUB_BOT_TOKEN).concurrent_updates(True)
+    if not with_updater:
+        # Webhook workers get their updates from the front process, not from Telegram.
+        builder = builder.updater(None)
+    app = builder.build()
 
-    print("✅ Bot is now listening..."); 
-    app = ApplicationBuilder().token(COINCUB_BOT_TOKEN).build()
-    
     # Register all command handlers 
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
@@ -186,8 +238,25 @@ def run_bot():
     # Register the text handler ONLY for private chats 
     # This prevents the bot from replying to every message in a group.
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE, private_text_handler))
-    
+    return app
+
+async def _start_metrics(app):
+    app.bot_data["metrics_runner"] = await start_metrics_server()
+
+def run_bot():
+    if BOT_MODE == "webhook":
+        from webhook_server import run_webhook_server
+        run_webhook_server()
+        return
+
+    # Keep the news cache warm in the background so replies never wait on the feeds.
+    start_rss_poller()
+
+    print("✅ Bot is now listening..."); 
+    app = build_application()
+    # Prometheus scrapes /metrics on METRICS_PORT, served from the bot's own event loop.
+    app.post_init = _start_metrics
     app.run_polling()
 
 if __name__ == "__main__": 
-    asyncio.run(run_bot())
\ No newline at end of file
+    run_bot()
@@ -0,0 +1,188 @@
+# telegram_output.py
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import NamedTuple
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+from telegram.helpers import escape_markdown
+from dotenv import load_dotenv
+
+from metrics import ERRORS, log_event, span
+
+load_dotenv()
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram's flood limits: ~30 messages/s overall, ~1/s per private chat, ~20/min per group.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1.0"))
+TELEGRAM_GROUP_INTERVAL = float(os.getenv("TELEGRAM_GROUP_INTERVAL", "3.0"))
+TELEGRAM_MAX_RETRIES = 3
+
+# Lines mentioning any of these never reach the user.
+_BLOCKED_LINE_RE = re.compile(r"\.env|readme|\.py|working directory", re.IGNORECASE)
+
+
+def clean_response(text: str) -> str:
+    return "\n".join(line for line in text.splitlines() if not _BLOCKED_LINE_RE.search(line))
+
+
+class RenderedChunk(NamedTuple):
+    markdown: str   # Escaped for MarkdownV2, guaranteed to fit in one message
+    plain: str      # The same text unescaped, used if Telegram rejects the markdown
+
+
+def _split_long_line(plain: str, limit: int) -> list[tuple]:
+    """Splits one line so every piece's *escaped* form fits, never cutting an escape sequence in half."""
+    pieces, start, size = [], 0, 0
+    for i, char in enumerate(plain):
+        cost = len(escape_markdown(char, version=2))
+        if size + cost > limit:
+            pieces.append(plain[start:i])
+            start, size = i, 0
+        size += cost
+    pieces.append(plain[start:])
+    return [(p, escape_markdown(p, version=2)) for p in pieces]
+
+
+def render_chunks(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[RenderedChunk]:
+    """
+    Cleans, escapes and splits a reply in one pass over its lines. Escaping happens
+    before splitting, so every chunk fits Telegram's limit *after* escaping. Chunks
+    break at a blank line (paragraph) when one is reasonably close, otherwise at a line.
+    """
+    lines = []
+    for line in str(text).splitlines():
+        if _BLOCKED_LINE_RE.search(line):
+            continue
+        escaped = escape_markdown(line, version=2)
+        lines.extend(_split_long_line(line, limit) if len(escaped) > limit else [(line, escaped)])
+
+    chunks = []
+    current, size = [], 0
+    last_paragraph = None   # index in `current` just after the most recent blank line
+
+    def flush(upto):
+        chunk = current[:upto]
+        while chunk and not chunk[-1][0].strip():
+            chunk.pop()
+        if chunk:
+            chunks.append(RenderedChunk("\n".join(e for _, e in chunk), "\n".join(p for p, _ in chunk)))
+        return current[upto:]
+
+    for plain, escaped in lines:
+        cost = len(escaped) + (1 if current else 0)
+        # Lines kept back after a paragraph break may still leave no room, so flush again until it fits.
+        while current and size + cost > limit:
+            upto = last_paragraph if last_paragraph and last_paragraph * 2 >= len(current) else len(current)
+            current = flush(upto)
+            while current and not current[0][0].strip():
+                current.pop(0)
+            size = sum(len(e) for _, e in current) + max(len(current) - 1, 0)
+            last_paragraph = None
+            cost = len(escaped) + (1 if current else 0)
+        current.append((plain, escaped))
+        size += cost
+        if not plain.strip():
+            last_paragraph = len(current)
+    flush(len(current))
+    return chunks
+
+
+class OutboundLimiter:
+    """
+    Paces everything we send to Telegram. Calls for the same chat run one at a time
+    in FIFO order and are spaced by the per-chat interval; all chats together stay
+    under the global rate. A RetryAfter from Telegram pauses that chat and retries.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+                 group_interval: float = TELEGRAM_GROUP_INTERVAL):
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self._global_next = 0.0
+        self._chat_next = {}
+        self._chat_locks = {}       # chat_id -> (lock, number of callers using it)
+
+    async def run(self, chat_id, send):
+        """Awaits `send()` (an async callable making one Telegram API call) once it's our turn."""
+        lock, users = self._chat_locks.get(chat_id, (asyncio.Lock(), 0))
+        self._chat_locks[chat_id] = (lock, users + 1)
+        try:
+            async with lock:
+                for attempt in range(TELEGRAM_MAX_RETRIES):
+                    # This chat's own spacing first, then a slot under the global rate.
+                    await asyncio.sleep(max(self._chat_next.get(chat_id, 0.0) - time.monotonic(), 0.0))
+                    await asyncio.sleep(self._reserve(chat_id))
+                    try:
+                        with span("telegram_send"):
+                            return await send()
+                    except RetryAfter as e:
+                        delay = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                        ERRORS.inc(stage="telegram_flood")
+                        log_event("telegram_flood_control", logging.WARNING, chat_id=chat_id, retry_after_s=delay)
+                        self._chat_next[chat_id] = time.monotonic() + delay
+                        if attempt == TELEGRAM_MAX_RETRIES - 1:
+                            raise
+        finally:
+            lock, users = self._chat_locks[chat_id]
+            if users > 1:
+                self._chat_locks[chat_id] = (lock, users - 1)
+            else:
+                # Nobody else is sending to this chat; drop its state unless it's still cooling down.
+                del self._chat_locks[chat_id]
+                if self._chat_next.get(chat_id, 0.0) <= time.monotonic():
+                    self._chat_next.pop(chat_id, None)
+
+    def _reserve(self, chat_id) -> float:
+        # No awaits in here, so reservations from concurrent senders never overlap.
+        now = time.monotonic()
+        start = max(now, self._global_next)
+        self._global_next = start + self.global_interval
+        interval = self.group_interval if isinstance(chat_id, int) and chat_id < 0 else self.chat_interval
+        self._chat_next[chat_id] = start + interval
+        return start - now
+
+
+outbound = OutboundLimiter()
+
+
+async def send_chunks(message, text: str):
+    """
+    Replies to `message` with `text`, split into MarkdownV2-safe chunks sent through the
+    outbound limiter. If Telegram rejects a chunk's markdown, only that chunk is resent as plain text.
+    """
+    chat_id = message.chat_id
+    for chunk in render_chunks(text):
+        try:
+            await outbound.run(chat_id, lambda: message.reply_text(chunk.markdown, parse_mode=ParseMode.MARKDOWN_V2))
+        except BadRequest as e:
+            ERRORS.inc(stage="telegram_markdown")
+            log_event("markdown_rejected", logging.WARNING, chat_id=chat_id, error=str(e))
+            await outbound.run(chat_id, lambda: message.reply_text(chunk.plain))
+
+
+# Checks that every chunk fits: python telegram_output.py [seed]
+if __name__ == "__main__":
+    import sys
+    import random
+
+    # A paragraph break followed by lines that still don't fit once the kept-back lines are counted.
+    chunks = render_chunks("\n".join(["a" * 10, "", "b" * 3000, "c" * 2000]))
+    assert [len(c.markdown) for c in chunks] == [10, 3000, 2000], [len(c.markdown) for c in chunks]
+
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else random.randrange(2 ** 32)
+    print(f"render_chunks: random check with seed {seed}")
+    rng = random.Random(seed)
+    for _ in range(2000):
+        limit = rng.randint(20, 400)
+        text = "\n".join(
+            "" if rng.random() < 0.2 else "".join(rng.choice("ab|*_.-()[]` ") for _ in range(rng.randint(1, 2 * limit)))
+            for _ in range(rng.randint(1, 30))
+        )
+        for chunk in render_chunks(text, limit):
+            assert len(chunk.markdown) <= limit, f"seed {seed}: a {len(chunk.markdown)}-char chunk at limit {limit}"
+    print("render_chunks: every chunk fits")
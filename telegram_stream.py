@@ -0,0 +1,108 @@
+# telegram_stream.py
+import os
+import asyncio
+import logging
+from telegram.error import BadRequest
+from dotenv import load_dotenv
+
+from metrics import log_event
+from telegram_output import TELEGRAM_MESSAGE_LIMIT, outbound
+
+load_dotenv()
+
+# Minimum seconds between edits of a streaming reply; Telegram throttles frequent edits per chat.
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") not in ("0", "false", "False", "")
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Splits text into pieces of at most `limit` characters, preferring to break at a newline."""
+    segments = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        segments.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        segments.append(text)
+    return segments
+
+
+class StreamingReply:
+    """
+    A reply that grows while the model is still generating.
+
+    `update()` can be called as often as output arrives; a background task edits the
+    sent message at most once per `edit_interval`, and starts a follow-up message
+    whenever the text crosses Telegram's 4096-character limit. `finish()` renders the
+    final text. Streamed messages are sent as plain text, since half-finished Markdown
+    would fail to parse. All calls go through the outbound limiter.
+    """
+
+    def __init__(self, message, edit_interval: float = STREAM_EDIT_INTERVAL, limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.started = False
+        self._text = ""
+        self._sent = []         # Telegram messages we've sent, in order
+        self._shown = []        # Text currently displayed in each of them
+        self._dirty = asyncio.Event()
+        self._task = None
+
+    def update(self, text: str):
+        """Sets the text shown so far. Cheap; the actual edits happen in the background."""
+        if not text.strip():
+            return
+        self._text = text
+        self.started = True
+        self._dirty.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def finish(self, final_text: str):
+        """Stops streaming and makes the messages show exactly `final_text`."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self._render(final_text or self._text)
+
+        # The final text can be shorter than what was streamed (e.g. an error after a fallback).
+        segments = len(split_message(final_text or self._text, self.limit))
+        for message in self._sent[segments:]:
+            try:
+                await message.delete()
+            except Exception as e:
+                log_event("stream_delete_failed", logging.WARNING, error=str(e))
+        del self._sent[segments:], self._shown[segments:]
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            await self._render(self._text)
+            await asyncio.sleep(self.edit_interval)
+
+    async def _render(self, text: str):
+        for i, segment in enumerate(split_message(text, self.limit)):
+            if i < len(self._sent):
+                if self._shown[i] != segment:
+                    if await self._send(self._sent[i].edit_text, segment) is not None:
+                        self._shown[i] = segment
+            else:
+                sent = await self._send(self.message.reply_text, segment)
+                if sent is None:
+                    return
+                self._sent.append(sent)
+                self._shown.append(segment)
+
+    async def _send(self, send, text: str):
+        try:
+            return await outbound.run(self.message.chat_id, lambda: send(text))
+        except BadRequest as e:
+            # "Message is not modified" and friends aren't worth failing the reply over.
+            log_event("stream_edit_rejected", logging.DEBUG, error=str(e))
+        except Exception as e:
+            log_event("stream_update_failed", logging.WARNING, error=str(e))
+        return None
@@ -0,0 +1,227 @@
+# webhook_server.py
+import os
+import asyncio
+import secrets
+import multiprocessing
+from aiohttp import web
+from telegram import Bot, Update
+from dotenv import load_dotenv
+
+from llm_scheduler import LLM_WORKERS
+from metrics import METRICS_PORT, Counter, handle_metrics, start_metrics_server
+
+load_dotenv()
+
+COINCUB_BOT_TOKEN = os.getenv("COINCUB_BOT_TOKEN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")              # Public base URL Telegram should call, e.g. https://bot.example.com
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Empty or unset: one worker per CPU core, but no more than LLM_WORKERS since each worker needs a Gemini slot.
+BOT_WORKERS = int(os.getenv("BOT_WORKERS") or min(os.cpu_count() or 1, LLM_WORKERS))
+WORKER_CHECK_INTERVAL = 5
+
+WEBHOOK_UPDATES = Counter("coincub_webhook_updates_total", "Updates received from Telegram, by worker.", ("worker",))
+WORKER_RESTARTS = Counter("coincub_worker_restarts_total", "Worker processes restarted after exiting.", ("worker",))
+
+# Spawned (not forked) workers start from a clean interpreter with no inherited threads.
+_mp = multiprocessing.get_context("spawn")
+
+
+def chat_id_of(update: dict):
+    """Finds the chat an incoming update belongs to, without building a full Update object."""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member", "chat_join_request"):
+        chat = (update.get(key) or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    callback = update.get("callback_query") or {}
+    chat = (callback.get("message") or {}).get("chat")
+    if chat:
+        return chat.get("id")
+    user = (update.get("inline_query") or {}).get("from") or {}
+    return user.get("id")
+
+
+def shard_for(chat_id, workers: int) -> int:
+    """Same chat, same worker: per-chat memory, queues and files only ever have one writer."""
+    try:
+        return abs(int(chat_id)) % workers
+    except (TypeError, ValueError):
+        return 0
+
+
+def llm_slots_for(index: int, workers: int) -> int:
+    """
+    This worker's share of LLM_WORKERS, so all workers together still run at most that many
+    Gemini CLI processes. The remainder goes to the lowest indexes; every worker gets at least one.
+    """
+    return max(LLM_WORKERS // workers + (1 if index < LLM_WORKERS % workers else 0), 1)
+
+
+def _worker_file(path: str, index: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{index}{ext}"
+
+
+# --- Worker process ---
+def worker_main(index: int, workers: int, updates, ready):
+    asyncio.run(_worker(index, workers, updates, ready))
+
+
+async def _worker(index: int, workers: int, updates, ready):
+    # Imported here so only worker processes load the bot, its stores and background threads.
+    import query_log
+    from fetch_rss import news_snapshot, start_rss_poller, start_snapshot_follower
+    from llm_scheduler import llm_scheduler
+    from telegram_bot import build_application, memory_store
+
+    # Each worker appends to its own query log, so processes never interleave writes,
+    # and only compacts memory files of the chats routed to it.
+    query_log.query_log.path = _worker_file(query_log.query_log.path, index)
+    memory_store.owns = lambda chat_id: shard_for(chat_id, workers) == index
+    llm_scheduler.workers = llm_slots_for(index, workers)
+    # Worker 0 polls the feeds; the others pick up what it saves to the shared snapshot.
+    if index == 0 or not news_snapshot:
+        start_rss_poller()
+    else:
+        start_snapshot_follower()
+    # The front process can't see a worker's metrics, so each worker serves its own on the next port up.
+    metrics_runner = await start_metrics_server(METRICS_PORT + 1 + index) if METRICS_PORT else None
+
+    app = build_application(with_updater=False)
+    await app.initialize()
+    await app.start()
+    ready.set()
+    print(f"✅ Webhook worker {index} is ready (pid {os.getpid()})")
+
+    try:
+        while True:
+            data = await asyncio.to_thread(updates.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        await app.shutdown()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+
+# --- Front process ---
+class WorkerPool:
+    """Owns the worker processes and their update queues, and restarts any worker that dies."""
+
+    def __init__(self, size: int = BOT_WORKERS):
+        self.size = max(size, 1)
+        self.queues = [_mp.Queue() for _ in range(self.size)]
+        self.ready = [_mp.Event() for _ in range(self.size)]
+        self.processes = [None] * self.size
+
+    def start(self):
+        for i in range(self.size):
+            self._spawn(i)
+
+    def _spawn(self, index: int):
+        self.ready[index].clear()
+        process = _mp.Process(target=worker_main, args=(index, self.size, self.queues[index], self.ready[index]),
+                              name=f"coincub-worker-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def restart_dead(self):
+        for i, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                print(f"⚠️ Webhook worker {i} exited with code {process.exitcode}; restarting it.")
+                WORKER_RESTARTS.inc(worker=i)
+                self._spawn(i)
+
+    def dispatch(self, update: dict):
+        shard = shard_for(chat_id_of(update), self.size)
+        WEBHOOK_UPDATES.inc(worker=shard)
+        self.queues[shard].put(update)
+
+    def is_ready(self) -> bool:
+        return all(p is not None and p.is_alive() for p in self.processes) and all(e.is_set() for e in self.ready)
+
+    def stop(self, timeout: float = 10):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    secret = request.app["secret"]
+    if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+        return web.Response(status=403)
+    try:
+        update = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    request.app["pool"].dispatch(update)
+    # Answer Telegram right away; the worker does the actual work.
+    return web.Response(text="ok")
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "alive"})
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    pool = request.app["pool"]
+    ready = pool.is_ready() and request.app["webhook_set"]
+    body = {"ready": ready, "workers": pool.size, "workers_ready": sum(e.is_set() for e in pool.ready)}
+    return web.json_response(body, status=200 if ready else 503)
+
+
+async def _supervise(app: web.Application):
+    while True:
+        await asyncio.sleep(WORKER_CHECK_INTERVAL)
+        app["pool"].restart_dead()
+
+
+async def _on_startup(app: web.Application):
+    app["pool"].start()
+    app["supervisor"] = asyncio.create_task(_supervise(app))
+    if WEBHOOK_URL:
+        # Registering the webhook ourselves means we can always require a secret token.
+        app["secret"] = app["secret"] or secrets.token_urlsafe(32)
+        async with Bot(COINCUB_BOT_TOKEN) as bot:
+            await bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=app["secret"])
+        app["webhook_set"] = True
+        print(f"✅ Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        print("⚠️ WEBHOOK_URL is not set; assuming the webhook is registered elsewhere.")
+        app["webhook_set"] = True
+
+
+async def _on_cleanup(app: web.Application):
+    app["supervisor"].cancel()
+    await asyncio.to_thread(app["pool"].stop)
+
+
+def create_app(pool: WorkerPool = None) -> web.Application:
+    app = web.Application()
+    app["pool"] = pool or WorkerPool()
+    app["webhook_set"] = False
+    app["secret"] = WEBHOOK_SECRET
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+def run_webhook_server():
+    print(f"✅ Bot is now listening for webhooks on {WEBHOOK_HOST}:{WEBHOOK_PORT} with {BOT_WORKERS} worker(s)...")
+    web.run_app(create_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)
+
+
+if __name__ == "__main__":
+    run_webhook_server()